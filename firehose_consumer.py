@@ -0,0 +1,101 @@
+"""
+The firehose consumer of twitter_firehose.py, put together in one place.
+
+A reader thread tags each tweet with its "matched_terms" and counts it in a
+`Rollup`, then queues it for `TweetWriter` threads, or appends it to a
+`Journal` when the queue is full. Writers divert batches to the journal while
+mongod is down. twitter_firehose.py runs this against the Twitter stream and
+firehose_loadtest.py against a local replay, so that the load test measures
+what production runs:
+
+    >>> journal = Journal("journal")
+    >>> consumer = Consumer(stream, db.tweets, words, journal,
+    ...                     rollups=db.rollups)
+    >>> consumer.run(report=report, report_interval=60)
+    >>> journal.close()
+"""
+from firehose_ingest import Ingest, SPILL
+from firehose_keywords import KeywordMatcher
+from firehose_rollup import Rollup
+from firehose_writer import TweetWriter
+
+# the terms twitter_firehose.py tracks
+TRACK = ["sequester", "boehner", "sequestration", "obama", "fiscal cliff",
+         "democrat", "republican", "compromise", "taxes", "deficit"]
+
+
+class Consumer(object):
+    """
+    Reads `stream` into `collection`, spilling to `journal`.
+
+    Parameters
+    ----------
+    stream : iterable
+        The tweet stream, e.g. a `tweetstream.FilterStream`.
+    collection : pymongo.collection.Collection
+        Where the tweets go.
+    terms : list of str
+        The tracked terms.
+    journal : Journal
+        Where tweets go when the queue is full or mongod is down.
+    rollups : pymongo.collection.Collection, optional
+        Where the rollup writes its per-minute counts.
+    n_writers : int
+        Number of writer threads.
+    maxsize : int
+        Size of the queue.
+    batch_size : int
+        Tweets per bulk write.
+    flush_interval : float
+        Seconds before a partial batch is written.
+    writer_class : class
+        Made with the collection, `writer_options` and the batch options in
+        each writer thread. A `TweetWriter` or a subclass.
+    writer_options : dict, optional
+        More keyword arguments for `writer_class`.
+    """
+    def __init__(self, stream, collection, terms, journal, rollups=None,
+                 n_writers=2, maxsize=50000, batch_size=500,
+                 flush_interval=1., writer_class=TweetWriter,
+                 writer_options=None):
+        self.collection = collection
+        self.journal = journal
+        self.matcher = KeywordMatcher(terms)
+        # per-minute mentions of each term and hashtag for the last hour,
+        # written to `rollups` every 10 seconds
+        self.rollup = Rollup(terms, collection=rollups)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.writer_class = writer_class
+        self.writer_options = writer_options or {}
+        # read and write in separate threads so a slow insert doesn't make
+        # us a slow reader. if mongod can't keep up, spill to the journal
+        # rather than block
+        self.ingest = Ingest(stream, self._new_writer, n_writers=n_writers,
+                             maxsize=maxsize, overflow=SPILL, spill=journal,
+                             prepare=self.prepare)
+
+    def _new_writer(self):
+        return self.writer_class(self.collection, batch_size=self.batch_size,
+                                 flush_interval=self.flush_interval,
+                                 fallback=self.journal, **self.writer_options)
+
+    def prepare(self, tweet):
+        """
+        Tag and count a tweet in the reader thread, before it is queued or
+        spilled, so that every tweet is stored tagged and counted once.
+        """
+        self.rollup.add(self.matcher.annotate(tweet))
+
+    def run(self, report=None, report_interval=60.):
+        """
+        Run `Ingest.run` until the stream ends, then flush the rollup. The
+        journal is left open.
+        """
+        try:
+            self.ingest.run(report=report, report_interval=report_interval)
+        finally:
+            self.rollup.close()
+
+    def metrics(self):
+        return self.ingest.metrics()
@@ -0,0 +1,168 @@
+"""
+Assigning streamed tweets to named regions.
+
+Twitter's `locations` filter also lets through tweets whose place only
+overlaps the bounding box, so tweets have to be filtered again locally. With
+many regions, testing each tweet against each region gets slow. A
+`GridIndex` puts the regions in the cells of a uniform grid of `cell_size`
+degrees, so a lookup only tests the few regions in the point's cell.
+
+    >>> index = GridIndex([
+    ...     Region.from_bbox("dc", ["-77.119759", "38.791645",
+    ...                             "-76.909393", "38.995548"]),
+    ...     Region("capitol", [(-77.0127, 38.8887), (-77.0074, 38.8887),
+    ...                        (-77.0074, 38.8911), (-77.0127, 38.8911)]),
+    ...     ])
+    >>> index.classify(tweet)
+    'capitol'
+
+A tweet's location is its exact "coordinates" if it has them, otherwise the
+center of its place's bounding box. When regions overlap, the smallest one
+containing the point wins.
+
+Coordinates are (longitude, latitude) throughout, as in GeoJSON and in the
+stream's `locations` parameter. Regions crossing the 180th meridian are not
+supported.
+"""
+import math
+
+
+class Region(object):
+    """
+    A named polygon.
+
+    Parameters
+    ----------
+    name : str
+    polygon : list of (lon, lat)
+        The vertices, without repeating the first one at the end.
+    """
+    def __init__(self, name, polygon):
+        self.name = name
+        self.polygon = [(float(lon), float(lat)) for lon, lat in polygon]
+        lons = [lon for lon, _ in self.polygon]
+        lats = [lat for _, lat in self.polygon]
+        self.bbox = (min(lons), min(lats), max(lons), max(lats))
+        # rectangles from `from_bbox` skip the point in polygon test
+        self.is_box = False
+        self.area = abs(sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in
+                            zip(self.polygon,
+                                self.polygon[1:] + self.polygon[:1]))) / 2
+
+    @classmethod
+    def from_bbox(cls, name, bbox):
+        """
+        A rectangular region from a [west, south, east, north] bounding box,
+        the format of the stream's `locations` parameter.
+        """
+        west, south, east, north = [float(x) for x in bbox]
+        region = cls(name, [(west, south), (east, south), (east, north),
+                            (west, north)])
+        region.is_box = True
+        return region
+
+    def __repr__(self):
+        return "Region(%r)" % self.name
+
+    def contains(self, lon, lat):
+        west, south, east, north = self.bbox
+        if not (west <= lon <= east and south <= lat <= north):
+            return False
+        if self.is_box:
+            return True
+        # ray casting
+        inside = False
+        polygon = self.polygon
+        x0, y0 = polygon[-1]
+        for x1, y1 in polygon:
+            if (y1 > lat) != (y0 > lat):
+                if lon < (x0 - x1) * (lat - y1) / (y0 - y1) + x1:
+                    inside = not inside
+            x0, y0 = x1, y1
+        return inside
+
+
+def tweet_point(tweet):
+    """
+    (lon, lat) of the tweet's "coordinates", or the center of its place's
+    bounding box, or None.
+    """
+    coordinates = tweet.get("coordinates")
+    if coordinates:
+        lon, lat = coordinates["coordinates"]
+        return float(lon), float(lat)
+    place = tweet.get("place") or {}
+    bounding_box = place.get("bounding_box") or {}
+    corners = (bounding_box.get("coordinates") or [None])[0]
+    if corners:
+        lons = [float(lon) for lon, _ in corners]
+        lats = [float(lat) for _, lat in corners]
+        return ((min(lons) + max(lons)) / 2, (min(lats) + max(lats)) / 2)
+    return None
+
+
+class GridIndex(object):
+    """
+    Regions indexed by the grid cells their bounding boxes overlap.
+
+    Parameters
+    ----------
+    regions : list of Region
+    cell_size : float
+        Width and height of a cell in degrees. About the size of a typical
+        region works well.
+    """
+    def __init__(self, regions=(), cell_size=1.):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.regions = []
+        for region in regions:
+            self.add(region)
+
+    def _cell(self, lon, lat):
+        return (int(math.floor(lon / self.cell_size)),
+                int(math.floor(lat / self.cell_size)))
+
+    def add(self, region):
+        self.regions.append(region)
+        west, south, east, north = region.bbox
+        x0, y0 = self._cell(west, south)
+        x1, y1 = self._cell(east, north)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                cell = self.cells.setdefault((x, y), [])
+                cell.append(region)
+                # smallest first, so the most specific region wins
+                cell.sort(key=lambda region: region.area)
+
+    def regions_at(self, lon, lat):
+        """
+        The regions containing the point, smallest first.
+        """
+        return [region for region in self.cells.get(self._cell(lon, lat), ())
+                if region.contains(lon, lat)]
+
+    def lookup(self, lon, lat):
+        """
+        Name of the smallest region containing the point, or None.
+        """
+        for region in self.cells.get(self._cell(lon, lat), ()):
+            if region.contains(lon, lat):
+                return region.name
+        return None
+
+    def classify(self, tweet):
+        """
+        Name of the region the tweet is in, or None.
+        """
+        point = tweet_point(tweet)
+        if point is None:
+            return None
+        return self.lookup(*point)
+
+    def annotate(self, tweet):
+        """
+        Set the tweet's "region" and return it.
+        """
+        tweet["region"] = self.classify(tweet)
+        return tweet
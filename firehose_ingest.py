@@ -0,0 +1,297 @@
+"""
+Reading the stream and writing to MongoDB in separate threads.
+
+When the loop that reads from the stream also writes to MongoDB, every slow
+write stalls the socket read and Twitter eventually disconnects us as a slow
+reader. `Ingest` runs a dedicated reader thread and one or more writer threads
+joined by a bounded queue. When the queue is full the overflow policy decides
+what happens to new tweets:
+
+* "block" - the reader waits for room, as before
+* "drop_oldest" - the oldest queued tweet is thrown away
+* "spill" - the tweet is appended to a file on disk instead
+
+    >>> ingest = Ingest(stream, lambda: BulkWriter(db.tweets), n_writers=2,
+    ...                 overflow="spill", spill=SpillFile("overflow.json"))
+    >>> def report(metrics):
+    ...     print(format_metrics(metrics))
+    >>> ingest.run(report=report, report_interval=60)
+
+`metrics` reports how full the queue is. A queue that stays close to full
+means the writers cannot keep up and a disconnect is not far off.
+"""
+import json
+import threading
+import time
+from Queue import Queue, Empty, Full
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+SPILL = "spill"
+
+# marks the end of the stream in the queue
+_DONE = object()
+
+
+class SpillFile(object):
+    """
+    Appends tweets to a file as lines of JSON.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fout = open(path, "a")
+        self._lock = threading.Lock()
+
+    def append(self, doc):
+        line = json.dumps(doc, default=str)
+        with self._lock:
+            self.fout.write(line)
+            self.fout.write("\n")
+
+    def close(self):
+        self.fout.close()
+
+
+class Ingest(object):
+    """
+    A stream reader thread and writer threads joined by a bounded queue.
+
+    Parameters
+    ----------
+    stream : iterable
+        The tweet stream, e.g. a `tweetstream.FilterStream`.
+    writer_factory : callable
+        Called once in each writer thread to make its writer, an object with
+        `add(doc)`, `maybe_flush()` and `close()` such as a `BulkWriter`.
+    n_writers : int
+        Number of writer threads.
+    maxsize : int
+        Size of the queue.
+    overflow : str
+        What to do when the queue is full, "block", "drop_oldest" or "spill".
+    spill : object, optional
+        Where spilled tweets go, with `append(doc)`. Required for "spill".
+    idle_timeout : float
+        Seconds a writer waits for a tweet before calling `maybe_flush`.
+    prepare : callable, optional
+        Called with each tweet in the reader thread before it is queued or
+        spilled, e.g. `KeywordMatcher.annotate`. Tweets are stored as it
+        leaves them, whichever way they go.
+    """
+    def __init__(self, stream, writer_factory, n_writers=1, maxsize=10000,
+                 overflow=BLOCK, spill=None, idle_timeout=.5, prepare=None):
+        if overflow not in (BLOCK, DROP_OLDEST, SPILL):
+            raise ValueError("Unknown overflow policy %r" % overflow)
+        if overflow == SPILL and spill is None:
+            raise ValueError("overflow='spill' needs somewhere to spill to")
+        self.stream = stream
+        self.writer_factory = writer_factory
+        self.n_writers = n_writers
+        self.queue = Queue(maxsize)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.spill = spill
+        self.idle_timeout = idle_timeout
+        self.prepare = prepare
+        self.writers = []
+        self.error = None
+        self.writer_error = None
+        self.read = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.high_water = 0
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _writers_alive(self):
+        return any(thread.is_alive() for thread in self._threads[1:])
+
+    def _put_blocking(self, doc):
+        """
+        Put, waiting for room for as long as there is a writer to make it.
+        Returns False if every writer has died.
+        """
+        while True:
+            try:
+                self.queue.put(doc, timeout=self.idle_timeout)
+                return True
+            except Full:
+                if not self._writers_alive():
+                    return False
+
+    def _put(self, doc):
+        queue = self.queue
+        if self.overflow == BLOCK:
+            if not self._put_blocking(doc):
+                if self.spill is not None:
+                    self.spill.append(doc)
+                    self.spilled += 1
+                else:
+                    self.dropped += 1
+        elif self.overflow == SPILL:
+            try:
+                queue.put_nowait(doc)
+            except Full:
+                self.spill.append(doc)
+                self.spilled += 1
+        else:
+            while True:
+                try:
+                    queue.put_nowait(doc)
+                    break
+                except Full:
+                    try:
+                        queue.get_nowait()
+                        self.dropped += 1
+                    except Empty:
+                        pass
+        depth = queue.qsize()
+        if depth > self.high_water:
+            self.high_water = depth
+
+    def _read(self):
+        prepare = self.prepare
+        try:
+            for doc in self.stream:
+                self.read += 1
+                if prepare is not None:
+                    prepare(doc)
+                self._put(doc)
+                if self._stop.is_set():
+                    break
+        except Exception as err:
+            self.error = err
+        finally:
+            for _ in range(self.n_writers):
+                if not self._put_blocking(_DONE):
+                    break
+
+    def _write(self):
+        writer = None
+        try:
+            writer = self.writer_factory()
+            self.writers.append(writer)
+            while True:
+                try:
+                    doc = self.queue.get(timeout=self.idle_timeout)
+                except Empty:
+                    writer.maybe_flush()
+                    continue
+                if doc is _DONE:
+                    break
+                writer.add(doc)
+        except Exception as err:
+            # stop reading rather than fill the queue for writers that are
+            # failing. run() raises the error
+            if self.writer_error is None:
+                self.writer_error = err
+            self.stop()
+        finally:
+            if writer is not None:
+                try:
+                    writer.close()
+                except Exception as err:
+                    if self.writer_error is None:
+                        self.writer_error = err
+                    self.stop()
+
+    def _spill_queue(self):
+        """
+        Move what is left in the queue to the spill file.
+        """
+        while True:
+            try:
+                doc = self.queue.get_nowait()
+            except Empty:
+                break
+            if doc is not _DONE:
+                self.spill.append(doc)
+                self.spilled += 1
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._read)]
+        self._threads += [threading.Thread(target=self._write)
+                          for _ in range(self.n_writers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """
+        Stop reading after the next tweet. Queued tweets are still written.
+        """
+        self._stop.set()
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run(self, report=None, report_interval=60.):
+        """
+        Start, then wait for the stream to end and the queue to drain.
+
+        If given, `report` is called with `metrics()` every
+        `report_interval` seconds. Raises the reader's error, if any, once
+        everything queued has been written. If a writer fails, reading stops
+        and the writer's error is raised once the writers have finished.
+        """
+        self.start()
+        try:
+            last_report = time.time()
+            while self.is_alive():
+                if (self.writer_error is not None and
+                        not self._writers_alive()):
+                    # the reader may be waiting on a quiet stream
+                    break
+                alive = [thread for thread in self._threads
+                         if thread.is_alive()]
+                if alive:
+                    alive[0].join(min(report_interval, 1.))
+                if (report is not None and
+                        time.time() - last_report >= report_interval):
+                    report(self.metrics())
+                    last_report = time.time()
+            if self.writer_error is None:
+                self.join()
+            elif self.spill is not None:
+                self._spill_queue()
+        except KeyboardInterrupt:
+            self.stop()
+            self.join()
+        if self.error is not None:
+            raise self.error
+        if self.writer_error is not None:
+            raise self.writer_error
+
+    def metrics(self):
+        """
+        Queue depth and counters as a dict.
+        """
+        depth = self.queue.qsize()
+        return {
+            "depth" : depth,
+            "maxsize" : self.maxsize,
+            "fill" : float(depth) / self.maxsize if self.maxsize else 0.,
+            "high_water" : self.high_water,
+            "read" : self.read,
+            "written" : sum(getattr(writer, "written", 0)
+                            for writer in self.writers),
+            "dropped" : self.dropped,
+            "spilled" : self.spilled,
+            "diverted" : sum(getattr(writer, "diverted", 0)
+                             for writer in self.writers),
+            "writers" : sum(thread.is_alive()
+                            for thread in self._threads[1:]),
+            "writer_error" : self.writer_error,
+            }
+
+
+def format_metrics(metrics):
+    return ("queue %(depth)d/%(maxsize)d (%(fill).0f%%, high water "
+            "%(high_water)d), read %(read)d, written %(written)d, dropped "
+            "%(dropped)d, spilled %(spilled)d, diverted %(diverted)d, "
+            "writers %(writers)d" %
+            dict(metrics, fill=100 * metrics["fill"]))
@@ -0,0 +1,264 @@
+"""
+Append-only journal of tweets on local disk, and replay into MongoDB.
+
+If mongod is down or slow, tweets that cannot be written are appended to a
+`Journal` instead of being lost. The journal is a directory of numbered
+newline-delimited JSON segment files. Appends are synced to disk in groups,
+once every `sync_every` tweets or `sync_interval` seconds, so capture runs at
+disk speed. A new segment is started when the current one reaches
+`segment_bytes`.
+
+Once the database is back, load the journal into the tweets collection:
+
+    $ python firehose_journal.py replay ./journal --db tweets
+
+Replay records how far it got in the journal directory, so running it again
+(or after a crash) resumes from there. Tweets are upserted on their id, so
+the batch that was being written when a replay crashed is not duplicated.
+"""
+import glob
+import json
+import os
+import threading
+import time
+
+from firehose_writer import TweetWriter
+
+SEGMENT_PATTERN = "tweets-%010d.jsonl"
+OFFSET_FILE = "replay.offset"
+REJECTED_FILE = "rejected.jsonl"
+
+
+def segments(directory):
+    """
+    The journal's segment files in order.
+    """
+    return sorted(glob.glob(os.path.join(directory, "tweets-*.jsonl")))
+
+
+class Journal(object):
+    """
+    Segmented, append-only journal of JSON documents with group commit.
+
+    Parameters
+    ----------
+    directory : str
+        Created if it does not exist.
+    segment_bytes : int
+        Start a new segment once the current one is this big.
+    sync_every : int
+        fsync after this many appends...
+    sync_interval : float
+        ...or after this many seconds, whichever comes first. A background
+        thread syncs appends that are this old when no more arrive.
+    """
+    def __init__(self, directory, segment_bytes=64 * 2**20, sync_every=1000,
+                 sync_interval=1.):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        existing = segments(directory)
+        if existing:
+            name = os.path.basename(existing[-1])
+            self.segment = int(name[len("tweets-"):-len(".jsonl")])
+            _truncate_partial_line(existing[-1])
+        else:
+            self.segment = 0
+        self.appended = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._open()
+        self._closed = threading.Event()
+        self._syncer = threading.Thread(target=self._sync_idle)
+        self._syncer.daemon = True
+        self._syncer.start()
+
+    def _open(self):
+        self.path = os.path.join(self.directory,
+                                 SEGMENT_PATTERN % self.segment)
+        self.fout = open(self.path, "ab")
+        self.size = self.fout.tell()
+        self.last_sync = time.time()
+
+    def append(self, doc):
+        line = (json.dumps(doc, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            self.fout.write(line)
+            self.size += len(line)
+            self.appended += 1
+            self._pending += 1
+            if (self._pending >= self.sync_every or
+                    time.time() - self.last_sync >= self.sync_interval):
+                self._sync()
+            if self.size >= self.segment_bytes:
+                self._rotate()
+
+    def _sync(self):
+        self.fout.flush()
+        os.fsync(self.fout.fileno())
+        self._pending = 0
+        self.last_sync = time.time()
+
+    def _sync_idle(self):
+        while not self._closed.wait(self.sync_interval):
+            with self._lock:
+                if (self._pending and not self.fout.closed and
+                        time.time() - self.last_sync >= self.sync_interval):
+                    self._sync()
+
+    def _rotate(self):
+        self._sync()
+        self.fout.close()
+        self.segment += 1
+        self._open()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._sync()
+            self.fout.close()
+
+
+def _truncate_partial_line(path):
+    """
+    Cut off a last line without a newline, left by a crash mid-append, so
+    that the next append does not run into it.
+    """
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        position = end
+        while position > 0:
+            start = max(position - 4096, 0)
+            f.seek(start)
+            block = f.read(position - start)
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            f.truncate(position)
+
+
+def _load_offset(directory):
+    path = os.path.join(directory, OFFSET_FILE)
+    if not os.path.exists(path):
+        return None, 0
+    with open(path) as fin:
+        offset = json.load(fin)
+    return offset["segment"], offset["offset"]
+
+
+def _save_offset(directory, segment, offset):
+    path = os.path.join(directory, OFFSET_FILE)
+    with open(path + ".tmp", "w") as fout:
+        json.dump({"segment" : segment, "offset" : offset}, fout)
+    os.rename(path + ".tmp", path)
+
+
+def replay(directory, writer, batch_size=1000, delete=False):
+    """
+    Load the journal in `directory` into MongoDB, starting where the last
+    replay stopped.
+
+    Parameters
+    ----------
+    directory : str
+    writer : BulkWriter
+        Where to write the tweets, usually a `TweetWriter` so that tweets
+        replayed twice are stored once. It is flushed after every `batch_size`
+        tweets and the resume offset is saved after each flush.
+    batch_size : int
+    delete : bool
+        Delete segments once they have been replayed, except for the last
+        one, which may still be being written to.
+
+    Returns
+    -------
+    n : int
+        Number of tweets replayed.
+    rejected : int
+        Number of lines that were not valid JSON. They are appended to
+        rejected.jsonl in the journal directory and skipped.
+    """
+    resume_segment, resume_offset = _load_offset(directory)
+    paths = segments(directory)
+    n = 0
+    rejected = 0
+    for i, path in enumerate(paths):
+        name = os.path.basename(path)
+        last = i == len(paths) - 1
+        if resume_segment is not None and name < resume_segment:
+            if delete and not last:
+                os.remove(path)
+            continue
+        offset = resume_offset if name == resume_segment else 0
+        with open(path, "rb") as fin:
+            fin.seek(offset)
+            pending = 0
+            while True:
+                line = fin.readline()
+                # a line without a newline is still being written
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    doc = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    with open(os.path.join(directory, REJECTED_FILE),
+                              "ab") as fout:
+                        fout.write(line)
+                    rejected += 1
+                    continue
+                writer.add(doc)
+                pending += 1
+                if pending >= batch_size:
+                    writer.flush()
+                    n += pending
+                    pending = 0
+                    _save_offset(directory, name, fin.tell())
+            writer.flush()
+            n += pending
+            _save_offset(directory, name, fin.tell() - len(line))
+        if delete and not last:
+            os.remove(path)
+    return n, rejected
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import pymongo
+
+    parser = argparse.ArgumentParser(description="Tweet journal tools")
+    subparsers = parser.add_subparsers(dest="command")
+    replay_parser = subparsers.add_parser(
+        "replay", help="bulk load a journal into MongoDB")
+    replay_parser.add_argument("directory")
+    replay_parser.add_argument("--host", default="localhost")
+    replay_parser.add_argument("--port", type=int, default=27017)
+    replay_parser.add_argument("--db", default="tweets")
+    replay_parser.add_argument("--collection", default="tweets")
+    replay_parser.add_argument("--batch-size", type=int, default=1000)
+    replay_parser.add_argument("--delete", action="store_true",
+                               help="delete segments once replayed")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.host, args.port)
+    collection = client[args.db][args.collection]
+    # flushes are driven by replay, not by the writer
+    writer = TweetWriter(collection, batch_size=args.batch_size + 1,
+                         flush_interval=float("inf"))
+    n, rejected = replay(args.directory, writer, args.batch_size, args.delete)
+    print("replayed %d tweets" % n)
+    if rejected:
+        print("%d lines were not valid JSON, see %s" % (
+            rejected, os.path.join(args.directory, REJECTED_FILE)))
+    print(writer.report())
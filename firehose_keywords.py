@@ -0,0 +1,126 @@
+"""
+Which of the tracked terms a tweet matched.
+
+Tweets from `FilterStream(track=words)` do not say which term they matched,
+and checking every term against the text costs O(terms x text) per tweet.
+`KeywordMatcher` builds an Aho-Corasick automaton from the track list once
+and then finds all the terms in one pass over the text, however many terms
+there are. Matching ignores case and extra whitespace, and a term only
+matches whole words, so "tax" matches "#tax" and "Tax!" but not "taxes".
+
+    >>> matcher = KeywordMatcher(["fiscal cliff", "sequester", "tax"])
+    >>> matcher.matches(u"The FISCAL  cliff and the #sequester")
+    [u'fiscal cliff', u'sequester']
+    >>> matcher.annotate(tweet)["matched_terms"]
+"""
+import re
+from collections import deque
+
+space_pattern = re.compile(r"\s+", re.UNICODE)
+
+
+def normalize(text):
+    return space_pattern.sub(u" ", text.lower())
+
+
+def _is_word(char):
+    return char.isalnum() or char == u"_"
+
+
+class KeywordMatcher(object):
+    """
+    Aho-Corasick automaton over a list of terms.
+
+    Parameters
+    ----------
+    terms : list of str
+        Words or phrases. They are lowercased and their whitespace is
+        collapsed, and matches are reported in that form.
+    """
+    def __init__(self, terms):
+        self.terms = []
+        # state -> {char : next state}
+        self.goto = [{}]
+        # state -> state of the longest proper suffix in the automaton
+        self.fail = [0]
+        # state -> [(term index, length), ...] of terms ending there
+        self.output = [[]]
+        seen = {}
+        for term in terms:
+            term = normalize(term).strip()
+            if not term or term in seen:
+                continue
+            seen[term] = len(self.terms)
+            self.terms.append(term)
+            self._insert(term, seen[term])
+        self._link()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _insert(self, term, index):
+        state = 0
+        for char in term:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append((index, len(term)))
+
+    def _link(self):
+        # breadth first so that a state's failure link is done before its
+        # children's
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.output[next_state] = (self.output[next_state] +
+                                           self.output[self.fail[next_state]])
+
+    def iter_matches(self, text):
+        """
+        Yield (term, start, end) for each whole-word match in the normalized
+        `text`.
+        """
+        text = normalize(text)
+        goto, fail, output, terms = (self.goto, self.fail, self.output,
+                                     self.terms)
+        n = len(text)
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index, length in output[state]:
+                start = end - length
+                if ((start == 0 or not _is_word(text[start - 1])) and
+                        (end == n or not _is_word(text[end]))):
+                    yield terms[index], start, end
+
+    def matches(self, text):
+        """
+        The distinct terms in `text`, in the order they first appear.
+        """
+        found = []
+        seen = set()
+        for term, _, _ in self.iter_matches(text):
+            if term not in seen:
+                seen.add(term)
+                found.append(term)
+        return found
+
+    def annotate(self, tweet):
+        """
+        Set the tweet's "matched_terms" and return it.
+        """
+        tweet["matched_terms"] = self.matches(tweet.get("text") or u"")
+        return tweet
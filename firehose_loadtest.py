@@ -0,0 +1,355 @@
+"""
+Load test of the firehose consumer against a local replay stream.
+
+Runs the `Consumer` that twitter_firehose.py runs - keyword tagging and
+rollup counting in the stream reader thread, `Ingest`'s bounded queue,
+`TweetWriter` threads, and spilling to a `Journal` when the queue is full -
+against a `ReplayServer` on localhost, and reports
+
+* throughput, overall and sustained until the consumer fell behind
+* end-to-end latency percentiles, from the time the server sent a tweet to
+  the time its batch was written
+* the offered rate at which the consumer fell behind: when the tweets the
+  profile asked for but that have not been written to the collection yet
+  are more than `behind_lag` seconds' worth at the offered rate, or when the
+  queue is more than `behind_fill` full
+* how many tweets spilled to the journal, and whether the rollup counted the
+  terms of every tweet stored, in the collection or in the journal
+
+Nothing leaves the machine. Tweets go to an in-memory `FakeCollection` that
+can be given a write latency, or to a scratch collection of a local mongod.
+The journal goes to a temporary directory that is removed afterwards.
+
+    $ python firehose_loadtest.py --profile ramp:500:20000:60 --duration 60
+    $ python firehose_loadtest.py tweets.json --mongo localhost:27017
+
+The scratch collection, loadtest.tweets, is dropped at the start of a run.
+"""
+import shutil
+import tempfile
+import threading
+import time
+
+from firehose_consumer import TRACK, Consumer
+from firehose_journal import Journal, replay
+from firehose_replay import ReplayServer, StreamClient, synthetic_tweets
+from firehose_rollup import TERM
+from firehose_writer import TweetWriter
+
+
+class _FakeBulk(object):
+    def __init__(self, collection):
+        self.collection = collection
+        self.ops = []
+
+    def insert(self, doc):
+        self.ops.append(("insert", None, doc))
+
+    def find(self, selector):
+        return _FakeFind(self, selector)
+
+    def execute(self, write_concern=None):
+        return self.collection._execute(self.ops)
+
+
+class _FakeFind(object):
+    def __init__(self, bulk, selector):
+        self.bulk = bulk
+        self.selector = selector
+
+    def upsert(self):
+        return self
+
+    def replace_one(self, doc):
+        self.bulk.ops.append(("replace", self.selector["_id"], doc))
+
+    def update_one(self, update):
+        self.bulk.ops.append(("update", self.selector["_id"], update))
+
+
+class FakeCollection(object):
+    """
+    Just enough of a pymongo collection for `BulkWriter`, `TweetWriter` and
+    `Rollup`, keeping the documents in a dict.
+
+    Parameters
+    ----------
+    write_latency : float
+        Seconds each bulk write takes, like the round-trip to mongod.
+    doc_latency : float
+        Further seconds per document written.
+    """
+    def __init__(self, write_latency=0., doc_latency=0.):
+        self.write_latency = write_latency
+        self.doc_latency = doc_latency
+        self.docs = {}
+        self.indexes = []
+        self._lock = threading.Lock()
+
+    def initialize_unordered_bulk_op(self):
+        return _FakeBulk(self)
+
+    initialize_ordered_bulk_op = initialize_unordered_bulk_op
+
+    def ensure_index(self, keys, **kwargs):
+        self.indexes.append(keys)
+
+    def count(self):
+        return len(self.docs)
+
+    def find(self):
+        with self._lock:
+            return list(self.docs.values())
+
+    def _execute(self, ops):
+        delay = self.write_latency + self.doc_latency * len(ops)
+        if delay:
+            time.sleep(delay)
+        result = {"nInserted" : 0, "nUpserted" : 0, "nModified" : 0,
+                  "nMatched" : 0}
+        docs = self.docs
+        with self._lock:
+            for op, _id, doc in ops:
+                if op == "insert":
+                    docs[len(docs)] = doc
+                    result["nInserted"] += 1
+                    continue
+                if _id in docs:
+                    result["nMatched"] += 1
+                    result["nModified"] += 1
+                else:
+                    result["nUpserted"] += 1
+                if op == "replace":
+                    docs[_id] = doc
+                else:
+                    current = docs.setdefault(
+                        _id, dict(doc.get("$setOnInsert", {})))
+                    for key, n in doc.get("$inc", {}).items():
+                        current[key] = current.get(key, 0) + n
+        return result
+
+
+class LatencyWriter(TweetWriter):
+    """
+    A `TweetWriter` that records the seconds from each tweet's
+    "timestamp_ms" to the end of the write of its batch.
+    """
+    def __init__(self, collection, latencies, **kwargs):
+        TweetWriter.__init__(self, collection, **kwargs)
+        self.latencies = latencies
+
+    def flush(self):
+        batch = self.batch
+        n = TweetWriter.flush(self)
+        now = time.time()
+        latencies = self.latencies
+        for doc in batch:
+            timestamp_ms = doc.get("timestamp_ms")
+            if timestamp_ms is not None:
+                latencies.append(now - int(timestamp_ms) / 1000.)
+        return n
+
+
+class _Collector(object):
+    """
+    Stands in for a writer to read the journal back with `replay`.
+    """
+    def __init__(self):
+        self.docs = []
+
+    def add(self, doc):
+        self.docs.append(doc)
+
+    def flush(self):
+        pass
+
+
+def percentile(values, q):
+    """
+    The q-th percentile of sorted `values`, by the nearest rank.
+    """
+    if not values:
+        return float("nan")
+    rank = int(round(q / 100. * (len(values) - 1)))
+    return values[rank]
+
+
+def run_load_test(tweets=None, profile="ramp:500:20000:60", duration=60.,
+                  collection=None, terms=TRACK, n_writers=2, maxsize=50000,
+                  batch_size=500, flush_interval=1., sample_interval=1.,
+                  behind_fill=.5, behind_lag=2., delimited=False):
+    """
+    Replay `tweets` at the `profile` rate for `duration` seconds through the
+    consumer and return the measurements as a dict.
+
+    `collection` defaults to a `FakeCollection` without latency. Made-up
+    tweets are used if `tweets` is not given.
+    """
+    if tweets is None:
+        tweets = synthetic_tweets(10000)
+    if collection is None:
+        collection = FakeCollection()
+    journal_dir = tempfile.mkdtemp(prefix="loadtest-journal-")
+    journal = Journal(journal_dir)
+    server = ReplayServer(("localhost", 0), tweets, profile, duration).start()
+    latencies = []
+    stream = StreamClient("localhost", server.port, delimited=delimited)
+    consumer = Consumer(stream, collection, terms, journal,
+                        rollups=FakeCollection(), n_writers=n_writers,
+                        maxsize=maxsize, batch_size=batch_size,
+                        flush_interval=flush_interval,
+                        writer_class=LatencyWriter,
+                        writer_options={"latencies" : latencies})
+    samples = []
+    started = time.time()
+    state = {"last_written" : 0, "last_time" : started, "n_latencies" : 0}
+
+    def sample(metrics):
+        now = time.time()
+        n = len(latencies)
+        recent = sorted(latencies[state["n_latencies"]:n])
+        written = metrics["written"]
+        samples.append({
+            "time" : now - started,
+            "offered_rate" : server.rate,
+            "due" : server.due,
+            "sent" : server.sent,
+            "read" : metrics["read"],
+            "written" : written,
+            "spilled" : metrics["spilled"],
+            "write_rate" : ((written - state["last_written"]) /
+                            (now - state["last_time"])),
+            "fill" : metrics["fill"],
+            "median_latency" : percentile(recent, 50),
+            })
+        state.update(last_written=written, last_time=now, n_latencies=n)
+
+    try:
+        consumer.run(report=sample, report_interval=sample_interval)
+    finally:
+        server.stop()
+        journal.close()
+    elapsed = time.time() - started
+    ingest = consumer.ingest
+    metrics = ingest.metrics()
+    written = metrics["written"]
+
+    # every tweet stored, in the collection or in the journal, should have
+    # been counted by the rollup once for each of its terms
+    try:
+        journaled = _Collector()
+        replay(journal_dir, journaled)
+    finally:
+        shutil.rmtree(journal_dir, ignore_errors=True)
+    stored = journaled.docs
+    if isinstance(collection, FakeCollection):
+        stored = stored + collection.find()
+    else:
+        stored = stored + list(collection.find())
+    tagged = sum(len(doc.get("matched_terms") or ()) for doc in stored)
+    counted = sum(consumer.rollup.totals(TERM).values())
+
+    behind = None
+    for s in samples:
+        # no rate once the stream has ended
+        rate = s["offered_rate"]
+        lag = (s["due"] - s["written"]) / rate if rate > 0 else 0.
+        if lag >= behind_lag or s["fill"] >= behind_fill:
+            behind = s
+            break
+    if behind is None:
+        sustained = written / elapsed
+    else:
+        sustained = behind["written"] / behind["time"]
+
+    values = sorted(latencies)
+    return {
+        "elapsed" : elapsed,
+        "sent" : server.sent,
+        "read" : ingest.read,
+        "written" : written,
+        "spilled" : metrics["spilled"],
+        "diverted" : metrics["diverted"],
+        "stored" : len(stored),
+        "tagged" : tagged,
+        "counted" : counted,
+        "throughput" : written / elapsed,
+        "sustained" : sustained,
+        "high_water" : ingest.high_water,
+        "latency" : dict(("p%d" % q, percentile(values, q))
+                         for q in (50, 90, 99)),
+        "max_latency" : values[-1] if values else float("nan"),
+        "behind_at" : behind and behind["time"],
+        "behind_rate" : behind and behind["offered_rate"],
+        "samples" : samples,
+        }
+
+
+def format_result(result):
+    lines = [
+        "sent %(sent)d, read %(read)d, written %(written)d in %(elapsed).1f s"
+        % result,
+        "throughput %(throughput).0f tweets/s, sustained %(sustained).0f "
+        "tweets/s, queue high water %(high_water)d" % result,
+        "latency p50 %(p50).3f s, p90 %(p90).3f s, p99 %(p99).3f s, "
+        "max %(max).3f s" % dict(result["latency"],
+                                 max=result["max_latency"]),
+        "spilled %(spilled)d, diverted %(diverted)d, stored %(stored)d; "
+        "rollup counted %(counted)d term mentions of %(tagged)d tagged"
+        % result,
+        ]
+    if result["behind_at"] is None:
+        lines.append("kept up with the whole profile")
+    else:
+        lines.append("fell behind after %.1f s at an offered %.0f tweets/s" %
+                     (result["behind_at"], result["behind_rate"]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from firehose_replay import load_tweets
+
+    parser = argparse.ArgumentParser(
+        description="Load test the firehose consumer on a local stream")
+    parser.add_argument("tweets", nargs="?",
+                        help="JSON lines or mongoexport file; made-up "
+                             "tweets if not given")
+    parser.add_argument("--profile", default="ramp:500:20000:60")
+    parser.add_argument("--duration", type=float, default=60.)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--maxsize", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--delimited", action="store_true")
+    parser.add_argument("--mongo", metavar="HOST:PORT",
+                        help="write to loadtest.tweets of this mongod "
+                             "instead of an in-memory collection")
+    parser.add_argument("--write-latency", type=float, default=0.,
+                        help="seconds per bulk write of the in-memory "
+                             "collection")
+    parser.add_argument("--verbose", action="store_true",
+                        help="print every sample")
+    args = parser.parse_args()
+
+    if args.mongo:
+        import pymongo
+        host, _, port = args.mongo.partition(":")
+        client = pymongo.MongoClient(host, int(port or 27017))
+        collection = client.loadtest.tweets
+        collection.drop()
+    else:
+        collection = FakeCollection(args.write_latency)
+    tweets = load_tweets(args.tweets) if args.tweets else None
+    result = run_load_test(tweets, args.profile, args.duration, collection,
+                           n_writers=args.writers, maxsize=args.maxsize,
+                           batch_size=args.batch_size,
+                           delimited=args.delimited)
+    if args.verbose:
+        for s in result["samples"]:
+            print("%(time)6.1f s  offered %(offered_rate)7.0f/s  written "
+                  "%(write_rate)7.0f/s  queue %(fill)4.0f%%  median latency "
+                  "%(median_latency).3f s" % dict(s, fill=100 * s["fill"]))
+    print(format_result(result))
+    if result["counted"] != result["tagged"]:
+        raise SystemExit("the rollup missed some stored tweets")
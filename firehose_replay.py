@@ -0,0 +1,380 @@
+"""
+A local stand-in for the streaming API that replays recorded tweets.
+
+Measuring how many tweets per second the consumer keeps up with against the
+live API is neither repeatable nor possible offline. `ReplayServer` serves
+recorded tweets over HTTP the way the streaming endpoint does: one long
+chunked response with a tweet per line, or with each tweet prefixed by its
+length in bytes when the request has `delimited=length`. The rate follows a
+profile:
+
+* "constant:RATE" - RATE tweets a second
+* "ramp:START:END:SECONDS" - from START to END tweets a second over SECONDS
+* "burst:BASE:PEAK:PERIOD:LENGTH" - PEAK tweets a second for the first
+  LENGTH seconds of every PERIOD, BASE the rest of the time
+
+Each tweet is stamped with the time it was sent in "timestamp_ms", so that
+a consumer can measure its end-to-end latency.
+
+    $ python firehose_replay.py tweets.json --profile ramp:100:5000:60
+
+`StreamClient` is a minimal client for the stream:
+
+    >>> for tweet in StreamClient("localhost", 8080):
+    ...     print(tweet["text"])
+"""
+import json
+import threading
+import time
+from datetime import datetime
+
+import httplib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from bson import json_util
+
+from firehose_writer import TWITTER_TIME_FORMAT
+
+STREAM_PATH = "/1.1/statuses/filter.json"
+
+# seconds between bursts of writes
+TICK = .01
+
+
+def _twitter_time(value):
+    if isinstance(value, datetime):
+        return value.strftime(TWITTER_TIME_FORMAT)
+    return value
+
+
+def load_tweets(path):
+    """
+    Tweets from a file of JSON lines, such as `mongoexport` writes, or from a
+    JSON array (`mongoexport --jsonArray`). MongoDB `_id`s are dropped.
+
+    The MongoDB extended JSON of an export, such as {"$date" : ...} and
+    {"$numberLong" : ...}, is decoded, and the "created_at" dates that
+    `prepare_tweet` stored are turned back into Twitter's format, so the
+    tweets are served as the streaming API sent them.
+    """
+    with open(path) as fin:
+        text = fin.read()
+    if text.lstrip().startswith("["):
+        tweets = json_util.loads(text)
+    else:
+        tweets = [json_util.loads(line) for line in text.splitlines()
+                  if line.strip()]
+    for tweet in tweets:
+        tweet.pop("_id", None)
+        if "created_at" in tweet:
+            tweet["created_at"] = _twitter_time(tweet["created_at"])
+        user = tweet.get("user")
+        if isinstance(user, dict) and "created_at" in user:
+            user["created_at"] = _twitter_time(user["created_at"])
+    return tweets
+
+
+def synthetic_tweets(n, words=("sequester", "fiscal cliff", "obama",
+                                "taxes", "deficit")):
+    """
+    `n` small made-up tweets, for when there is no recording at hand.
+    """
+    tweets = []
+    for i in range(n):
+        word = words[i % len(words)]
+        tweets.append({
+            "id_str" : str(i),
+            "created_at" : "Mon Feb 25 12:00:00 +0000 2013",
+            "text" : "tweet %d about the %s #%s" % (i, word,
+                                                     word.replace(" ", "")),
+            "user" : {"id" : i % 1000, "screen_name" : "user%d" % (i % 1000)},
+            "entities" : {"hashtags" : [{"text" : word.replace(" ", "")}]},
+            "coordinates" : None,
+            })
+    return tweets
+
+
+def parse_profile(spec):
+    """
+    A function of the seconds since the start giving the rate in tweets a
+    second, from a spec like "ramp:100:5000:60".
+    """
+    name, args = spec.split(":", 1) if ":" in spec else (spec, "")
+    args = [float(arg) for arg in args.split(":") if arg]
+    if name == "constant" and len(args) == 1:
+        rate, = args
+        return lambda t: rate
+    if name == "ramp" and len(args) == 3:
+        start, end, seconds = args
+        return lambda t: start + (end - start) * min(t / seconds, 1.)
+    if name == "burst" and len(args) == 4:
+        base, peak, period, length = args
+        return lambda t: peak if t % period < length else base
+    raise ValueError("Unknown rate profile %r" % spec)
+
+
+class _StreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _write_chunk(self, data):
+        self.wfile.write(("%x\r\n" % len(data)).encode("ascii"))
+        self.wfile.write(data)
+        self.wfile.write(b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        server = self.server
+        delimited = "delimited=length" in self.path
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        tweets = server.tweets
+        started = time.time()
+        allowance = 0.
+        last = started
+        i = 0
+        try:
+            while not server.stopped.is_set():
+                now = time.time()
+                elapsed = now - started
+                if server.duration and elapsed >= server.duration:
+                    break
+                rate = server.profile(elapsed)
+                allowance += rate * (now - last)
+                server.offer(self, rate, rate * (now - last))
+                last = now
+                messages = []
+                while allowance >= 1:
+                    allowance -= 1
+                    tweet = dict(tweets[i % len(tweets)],
+                                 timestamp_ms=str(int(now * 1000)))
+                    if server.unique_ids:
+                        tweet["id_str"] = str(i)
+                    i += 1
+                    message = (json.dumps(tweet) + "\r\n").encode("utf-8")
+                    if delimited:
+                        length = ("%d\r\n" % len(message)).encode("ascii")
+                        message = length + message
+                    messages.append(message)
+                if messages:
+                    self._write_chunk(b"".join(messages))
+                    server.count(len(messages))
+                time.sleep(TICK)
+            self._write_chunk(b"")
+        except IOError:
+            # the client hung up
+            pass
+        finally:
+            server.offer(self, None, 0.)
+        self.close_connection = True
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves `tweets` over and over to every client following a rate profile.
+
+    Parameters
+    ----------
+    address : (host, port)
+        Port 0 picks a free port, see `port`.
+    tweets : list of dict
+    profile : str or callable
+        A profile spec for `parse_profile`, or a function of the seconds
+        since the client connected giving the rate in tweets a second.
+    duration : float, optional
+        End the stream after this many seconds.
+    unique_ids : bool
+        Give each tweet sent a new "id_str", so that replaying the same
+        tweets does not look like duplicates to an upserting consumer.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, tweets, profile="constant:100", duration=None,
+                 unique_ids=True):
+        if not tweets:
+            raise ValueError("Nothing to replay")
+        HTTPServer.__init__(self, address, _StreamHandler)
+        self.tweets = tweets
+        if not callable(profile):
+            profile = parse_profile(profile)
+        self.profile = profile
+        self.duration = duration
+        self.unique_ids = unique_ids
+        self.stopped = threading.Event()
+        # tweets the profile has asked for so far over all clients, sent or
+        # not
+        self.due = 0.
+        self.sent = 0
+        # client handler -> its current rate
+        self._rates = {}
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def rate(self):
+        """
+        The rate offered to all the clients together, in tweets a second.
+        """
+        with self._lock:
+            return sum(self._rates.values())
+
+    def offer(self, handler, rate, due):
+        """
+        Record a client's current rate, or None once it has gone, and the
+        tweets it has been asked for since the last call.
+        """
+        with self._lock:
+            if rate is None:
+                self._rates.pop(handler, None)
+            else:
+                self._rates[handler] = rate
+            self.due += due
+
+    def count(self, n):
+        with self._lock:
+            self.sent += n
+
+    def start(self):
+        """
+        Serve from a background thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
+
+
+class _ChunkedReader(object):
+    """
+    Undoes chunked transfer encoding on a file-like object.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        self.buffer = b""
+        # where the unread part of the buffer starts. a chunk holds many
+        # tweets, and slicing off the start of the buffer for each of them
+        # would copy the rest of the chunk every time
+        self.pos = 0
+        self.done = False
+
+    def _fill(self):
+        size = int(self.fp.readline().split(b";")[0], 16)
+        if size == 0:
+            self.done = True
+            return
+        self.buffer = self.buffer[self.pos:] + self.fp.read(size)
+        self.pos = 0
+        self.fp.readline()
+
+    def readline(self):
+        end = self.buffer.find(b"\n", self.pos)
+        while end == -1 and not self.done:
+            self._fill()
+            end = self.buffer.find(b"\n", self.pos)
+        end = end + 1 if end != -1 else len(self.buffer)
+        line = self.buffer[self.pos:end]
+        self.pos = end
+        return line
+
+    def read(self, n):
+        while len(self.buffer) - self.pos < n and not self.done:
+            self._fill()
+        data = self.buffer[self.pos:self.pos + n]
+        self.pos += len(data)
+        return data
+
+
+class StreamClient(object):
+    """
+    Iterates over the tweets of a streaming endpoint.
+
+    Blank keep-alive lines are skipped. With `delimited`, the stream is
+    asked for length-prefixed messages, which are read without scanning for
+    the end of line.
+    """
+    def __init__(self, host, port, path=STREAM_PATH, delimited=False,
+                 timeout=90):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.delimited = delimited
+        self.timeout = timeout
+        self.connection = None
+
+    def __iter__(self):
+        path = self.path
+        if self.delimited:
+            path += ("&" if "?" in path else "?") + "delimited=length"
+        self.connection = httplib.HTTPConnection(self.host, self.port,
+                                                 timeout=self.timeout)
+        self.connection.request("GET", path)
+        response = self.connection.getresponse()
+        if response.status != 200:
+            raise IOError("Stream returned %d %s" % (response.status,
+                                                     response.reason))
+        encoding = response.getheader("transfer-encoding") or ""
+        if encoding.lower() == "chunked":
+            reader = _ChunkedReader(response.fp)
+        else:
+            reader = response.fp
+        try:
+            while True:
+                line = reader.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                if self.delimited:
+                    line = reader.read(int(line)).strip()
+                yield json.loads(line.decode("utf-8"))
+        finally:
+            self.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Replay recorded tweets as a local streaming endpoint")
+    parser.add_argument("tweets", nargs="?",
+                        help="JSON lines or mongoexport file; made-up "
+                             "tweets if not given")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--profile", default="constant:100")
+    parser.add_argument("--duration", type=float)
+    args = parser.parse_args()
+
+    if args.tweets:
+        tweets = load_tweets(args.tweets)
+    else:
+        tweets = synthetic_tweets(10000)
+    server = ReplayServer((args.host, args.port), tweets, args.profile,
+                          args.duration)
+    print("replaying %d tweets on http://%s:%d%s" % (len(tweets), args.host,
+                                                     server.port,
+                                                     STREAM_PATH))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stopped.set()
+        server.server_close()
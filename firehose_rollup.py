@@ -0,0 +1,234 @@
+"""
+Per-minute counts of tracked terms and hashtags, kept while the tweets arrive.
+
+Finding the mentions per minute of each tracked term after the fact means
+scanning the whole tweets collection. A `Rollup` counts each tweet's terms
+and hashtags into time buckets as the tweet is read. The terms come from
+the tweet's "matched_terms", as set by `KeywordMatcher.annotate`. Each term
+has a ring buffer of `n_buckets` counts, so memory stays the same however
+long the stream runs. At most `max_hashtags` hashtags are counted at a time.
+
+Every `flush_interval` seconds a background thread writes the counts added
+since the last flush to a rollup collection, with one document per key and
+bucket:
+
+    {"_id" : "term:sequester:1361793600", "kind" : "term",
+     "key" : "sequester", "start" : datetime(2013, 2, 25, 12, 0),
+     "seconds" : 60, "count" : 42}
+
+A dashboard reads a few of these instead of millions of tweets.
+
+Add tweets to the rollup in `Ingest`'s reader thread, so that tweets that
+spill to the journal are counted as well as those that reach a writer:
+
+    >>> matcher = KeywordMatcher(words)
+    >>> rollup = Rollup(words, collection=db.rollups)
+    >>> def prepare(tweet):
+    ...     rollup.add(matcher.annotate(tweet))
+    >>> ingest = Ingest(stream, lambda: TweetWriter(db.tweets),
+    ...                 prepare=prepare)
+    >>> rollup.window("term", "sequester")
+"""
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from pymongo.errors import ConnectionFailure
+
+from firehose_keywords import normalize
+
+TERM = "term"
+HASHTAG = "hashtag"
+
+
+def tweet_time(tweet):
+    """
+    When the tweet was sent as seconds since the epoch, from "timestamp_ms"
+    if the stream gives it, otherwise the current time.
+    """
+    timestamp_ms = tweet.get("timestamp_ms")
+    if timestamp_ms is not None:
+        return int(timestamp_ms) / 1000.
+    return time.time()
+
+
+def hashtags(tweet):
+    entities = tweet.get("entities") or {}
+    return [hashtag["text"].lower()
+            for hashtag in entities.get("hashtags") or []]
+
+
+class Rollup(object):
+    """
+    Time-bucketed counters per tracked term and per hashtag.
+
+    Parameters
+    ----------
+    terms : list of str
+        The tracked terms, as given to the `KeywordMatcher` that sets the
+        tweets' "matched_terms".
+    bucket_seconds : int
+        Width of a bucket.
+    n_buckets : int
+        Number of buckets kept per key. The window covers
+        `bucket_seconds * n_buckets` seconds.
+    max_hashtags : int
+        Hashtags seen while this many are already being counted are not
+        counted. A hashtag is forgotten once it has no count in the window.
+    collection : pymongo.collection.Collection, optional
+        Where `flush` writes the rollup documents. If given, a background
+        thread flushes every `flush_interval` seconds until `close`.
+    flush_interval : float
+        Seconds between flushes.
+    """
+    def __init__(self, terms, bucket_seconds=60, n_buckets=60,
+                 max_hashtags=1000, collection=None, flush_interval=10.):
+        self.bucket_seconds = bucket_seconds
+        self.n_buckets = n_buckets
+        self.max_hashtags = max_hashtags
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.starts = [None] * n_buckets
+        self.counts = dict(((TERM, normalize(term).strip()), [0] * n_buckets)
+                           for term in terms)
+        self.n_hashtags = 0
+        self.late = 0
+        self.skipped_hashtags = 0
+        # (kind, key, bucket start) -> count not yet written
+        self.unflushed = Counter()
+        self.last_flush = time.time()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        if collection is not None:
+            self._flusher = threading.Thread(target=self._flush_idle)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _slot(self, timestamp):
+        """
+        The index of the bucket for `timestamp`, clearing the bucket if it
+        held an older period. None if the bucket already moved past it.
+        """
+        start = int(timestamp // self.bucket_seconds) * self.bucket_seconds
+        i = (start // self.bucket_seconds) % self.n_buckets
+        current = self.starts[i]
+        if current == start:
+            return i, start
+        if current is not None and current > start:
+            return None, start
+        self.starts[i] = start
+        for key, counts in list(self.counts.items()):
+            counts[i] = 0
+            if key[0] == HASHTAG and not any(counts):
+                del self.counts[key]
+                self.n_hashtags -= 1
+        return i, start
+
+    def _count(self, key, i, start):
+        counts = self.counts.get(key)
+        if counts is None:
+            if self.n_hashtags >= self.max_hashtags:
+                self.skipped_hashtags += 1
+                return
+            counts = self.counts[key] = [0] * self.n_buckets
+            self.n_hashtags += 1
+        counts[i] += 1
+        self.unflushed[key + (start,)] += 1
+
+    def add(self, tweet, timestamp=None):
+        """
+        Count the tweet's "matched_terms" and its hashtags.
+        """
+        if "text" not in tweet:
+            # delete and limit notices
+            return
+        terms = tweet.get("matched_terms") or ()
+        tags = hashtags(tweet)
+        if timestamp is None:
+            timestamp = tweet_time(tweet)
+        with self._lock:
+            i, start = self._slot(timestamp)
+            if i is None:
+                self.late += 1
+                return
+            for term in terms:
+                if (TERM, term) in self.counts:
+                    self._count((TERM, term), i, start)
+            for tag in tags:
+                self._count((HASHTAG, tag), i, start)
+
+    def window(self, kind, key):
+        """
+        [(bucket start, count), ...] for a key, oldest first.
+        """
+        with self._lock:
+            counts = self.counts.get((kind, key))
+            if counts is None:
+                return []
+            return sorted((start, counts[i])
+                          for i, start in enumerate(self.starts)
+                          if start is not None)
+
+    def totals(self, kind, seconds=None, now=None):
+        """
+        Counter of the counts of each key of `kind` over the last `seconds`,
+        or over the whole window.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            slots = [i for i, start in enumerate(self.starts)
+                     if start is not None and
+                     (seconds is None or start > now - seconds)]
+            totals = Counter()
+            for (kind_, key), counts in self.counts.items():
+                if kind_ == kind:
+                    n = sum(counts[i] for i in slots)
+                    if n:
+                        totals[key] = n
+        return totals
+
+    def flush(self):
+        """
+        Add the counts since the last flush to the rollup documents. Returns
+        the number of documents updated.
+        """
+        self.last_flush = time.time()
+        with self._lock:
+            unflushed, self.unflushed = self.unflushed, Counter()
+        if not unflushed or self.collection is None:
+            return 0
+        bulk = self.collection.initialize_unordered_bulk_op()
+        for (kind, key, start), n in unflushed.items():
+            update = {
+                "$setOnInsert" : {
+                    "kind" : kind,
+                    "key" : key,
+                    "start" : datetime.utcfromtimestamp(start),
+                    "seconds" : self.bucket_seconds,
+                    },
+                "$inc" : {"count" : n},
+                }
+            _id = "%s:%s:%d" % (kind, key, start)
+            bulk.find({"_id" : _id}).upsert().update_one(update)
+        try:
+            bulk.execute()
+        except ConnectionFailure:
+            # keep the counts for the next flush
+            with self._lock:
+                self.unflushed.update(unflushed)
+            return 0
+        return len(unflushed)
+
+    def _flush_idle(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def maybe_flush(self):
+        if time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        self.flush()
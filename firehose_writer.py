@@ -0,0 +1,217 @@
+"""
+Buffered bulk writes of tweets to MongoDB.
+
+`db.tweets.save(tweet)` waits for an acknowledged round-trip to mongod for
+every tweet, so during a spike the consumer falls behind the stream and
+Twitter disconnects it. `BulkWriter` collects tweets and writes them with one
+bulk operation whenever `batch_size` tweets are waiting or `flush_interval`
+seconds have passed, whichever comes first.
+
+    >>> with BulkWriter(db.tweets, batch_size=500) as writer:
+    ...     for tweet in stream:
+    ...         writer.add(tweet)
+    >>> print(writer.report())
+
+If a `fallback` such as a `firehose_journal.Journal` is given, a batch that
+cannot be written because mongod is unreachable is appended to it instead of
+raising, and can be replayed later.
+
+A reconnect or a journal replay sends some tweets twice, and `insert` stores
+them twice. `TweetWriter` instead upserts each tweet with its "id_str" as the
+`_id`, which the collection's unique `_id` index makes an O(1) lookup.
+`ensure_indexes` creates the indexes the analysis queries need:
+
+    >>> ensure_indexes(db.tweets)
+    >>> writer = TweetWriter(db.tweets)
+
+Needs pymongo >= 2.7 for the bulk write API.
+"""
+# strptime imports _strptime on its first call, which is not thread-safe in
+# Python 2 and fails in the writer threads unless it is imported up front
+import _strptime
+from datetime import datetime
+from timeit import default_timer as timer
+
+from pymongo.errors import BulkWriteError, ConnectionFailure
+
+
+class BulkWriter(object):
+    """
+    Writes documents to a collection in batches.
+
+    Parameters
+    ----------
+    collection : pymongo.collection.Collection
+    batch_size : int
+        Flush when this many documents are waiting.
+    flush_interval : float
+        Flush when this many seconds have passed since the last flush.
+    w : int or str
+        Write concern. 0 does not wait for acknowledgement, 1 waits for the
+        primary, "majority" for a majority of the replica set.
+    ordered : bool
+        With ordered writes mongod stops at the first error in a batch.
+        Unordered writes carry on and may be applied in parallel.
+    fallback : object, optional
+        With `append(doc)`. Gets the documents of batches that fail with a
+        connection error.
+    """
+    def __init__(self, collection, batch_size=500, flush_interval=1., w=1,
+                 ordered=False, fallback=None):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.write_concern = {"w" : w}
+        self.ordered = ordered
+        self.fallback = fallback
+        self.batch = []
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.diverted = 0
+        self.started = timer()
+        self.last_flush = self.started
+
+    def add(self, doc):
+        self.batch.append(doc)
+        if (len(self.batch) >= self.batch_size or
+                timer() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def maybe_flush(self):
+        """
+        Flush if `flush_interval` has passed. Call this when the stream is
+        idle so that a partial batch does not wait for the next document.
+        """
+        if self.batch and timer() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def _queue(self, bulk, doc):
+        bulk.insert(doc)
+
+    def flush(self):
+        """
+        Write the waiting documents. Returns the number written.
+        """
+        self.last_flush = timer()
+        if not self.batch:
+            return 0
+        batch, self.batch = self.batch, []
+        if self.ordered:
+            bulk = self.collection.initialize_ordered_bulk_op()
+        else:
+            bulk = self.collection.initialize_unordered_bulk_op()
+        for doc in batch:
+            self._queue(bulk, doc)
+        try:
+            result = bulk.execute(self.write_concern)
+        except BulkWriteError as err:
+            result = err.details
+            self.errors += len(result.get("writeErrors", []))
+        except ConnectionFailure:
+            if self.fallback is None:
+                raise
+            for doc in batch:
+                self.fallback.append(doc)
+            self.diverted += len(batch)
+            return 0
+        self.batches += 1
+        if result is None:
+            # unacknowledged writes do not report anything
+            n = len(batch)
+        else:
+            n = (result.get("nInserted", 0) + result.get("nUpserted", 0) +
+                 result.get("nModified", 0))
+        self.written += n
+        return n
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def stats(self):
+        """
+        Throughput so far as a dict.
+        """
+        elapsed = timer() - self.started
+        return {
+            "written" : self.written,
+            "batches" : self.batches,
+            "errors" : self.errors,
+            "diverted" : self.diverted,
+            "pending" : len(self.batch),
+            "elapsed" : elapsed,
+            "rate" : self.written / elapsed if elapsed > 0 else 0.,
+            }
+
+    def report(self):
+        return ("%(written)d written in %(batches)d batches, %(errors)d "
+                "errors, %(diverted)d diverted, %(rate).1f docs/s over "
+                "%(elapsed).1f s" %
+                self.stats())
+
+
+TWITTER_TIME_FORMAT = "%a %b %d %H:%M:%S +0000 %Y"
+
+# the indexes behind the queries run on the tweets collection
+TWEET_INDEXES = [
+    [("created_at", 1)],
+    [("user.id", 1), ("created_at", -1)],
+    [("entities.hashtags.text", 1)],
+    [("text", "text")],
+    ]
+
+# for $geoWithin and $near queries on the tweets' GeoJSON points
+GEO_INDEXES = [
+    [("coordinates", "2dsphere")],
+    ]
+
+
+def prepare_tweet(tweet):
+    """
+    A copy of the tweet keyed on its "id_str", with "created_at" as a
+    datetime so that it can be queried by range.
+
+    Stream messages without an id, such as delete or limit notices, are
+    returned as they are.
+    """
+    if "id_str" not in tweet:
+        return tweet
+    doc = dict(tweet, _id=tweet["id_str"])
+    created_at = doc.get("created_at")
+    if isinstance(created_at, basestring):
+        try:
+            doc["created_at"] = datetime.strptime(created_at,
+                                                  TWITTER_TIME_FORMAT)
+        except ValueError:
+            pass
+    return doc
+
+
+def ensure_indexes(collection, indexes=TWEET_INDEXES, geo=False):
+    """
+    Create any of `indexes` that `collection` does not have yet, and the
+    `GEO_INDEXES` too if `geo` is True.
+    """
+    if geo:
+        indexes = list(indexes) + GEO_INDEXES
+    for keys in indexes:
+        collection.ensure_index(keys, background=True)
+
+
+class TweetWriter(BulkWriter):
+    """
+    A `BulkWriter` that upserts tweets on their id, so writing the same tweet
+    twice stores it once.
+    """
+    def _queue(self, bulk, doc):
+        doc = prepare_tweet(doc)
+        if "_id" in doc:
+            bulk.find({"_id" : doc["_id"]}).upsert().replace_one(doc)
+        else:
+            bulk.insert(doc)
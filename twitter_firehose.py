@@ -6,7 +6,19 @@ import ConfigParser
 
 import tweetstream
 import pymongo
-connection = pymongo.Connection()
+from pymongo.errors import ConnectionFailure
+
+from firehose_consumer import TRACK, Consumer
+from firehose_ingest import format_metrics
+from firehose_journal import Journal
+from firehose_writer import ensure_indexes
+
+# don't connect until the first write, so that we can start capturing to the
+# journal while mongod is down
+if pymongo.version_tuple >= (3,):
+    connection = pymongo.MongoClient(connect=False)
+else:
+    connection = pymongo.MongoClient(_connect=False)
 db = connection.tweets
 
 def get_connection_secrets(cfg_name):
@@ -22,9 +34,7 @@ def get_connection_secrets(cfg_name):
 if __name__ == "__main__":
     (consumer_key, consumer_secret,
      access_token, access_token_secret) = get_connection_secrets("oauth.cfg")
-    words = ["sequester", "boehner", "sequestration", "obama",
-             "fiscal cliff", "democrat", "republican", "compromise",
-             "taxes", "deficit"]
+    words = TRACK
 
     # sw corner first
     #dc_bbox = ["-77.401428", "38.751941", "-76.728516", "39.123668"]
@@ -32,7 +42,31 @@ if __name__ == "__main__":
     #with tweetstream.FilterStream(consumer_key, consumer_secret, access_token,
     #                              access_token_secret, track=words,
     #                              locations=dc_bbox) as stream:
+    # tweets that can't go to mongod right now go to the journal. load them
+    # later with `python firehose_journal.py replay journal`
+    journal = Journal("journal")
+
+    def try_ensure_indexes():
+        try:
+            ensure_indexes(db.tweets, geo=True)
+            return True
+        except ConnectionFailure:
+            print("mongod is not reachable, writing tweets to the journal")
+            return False
+
+    indexed = [try_ensure_indexes()]
+
+    def report(metrics):
+        print(format_metrics(metrics))
+        if not indexed[0]:
+            indexed[0] = try_ensure_indexes()
+
+    # see firehose_consumer.py, which firehose_loadtest.py runs too
     with tweetstream.FilterStream(consumer_key, consumer_secret, access_token,
                                   access_token_secret, track=words) as stream:
-        for tweet in stream:
-            db.tweets.save(tweet)
+        consumer = Consumer(stream, db.tweets, words, journal,
+                            rollups=db.rollups)
+        try:
+            consumer.run(report=report, report_interval=60)
+        finally:
+            journal.close()
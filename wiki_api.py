@@ -0,0 +1,196 @@
+"""
+Batched retrieval of many pages per Wikipedia API request.
+
+Instead of one action=parse request per elector, `fetch_electors_batched`
+asks for up to `QUERY_LIMIT` titles at once with action=query. Redirects and
+title normalization are resolved for the whole batch, `continue` tokens are
+followed until the batch is complete, and the results are mapped back onto the
+elector dicts.
+
+The query API returns the wikitext of the latest revision rather than rendered
+HTML, so the text is run through `strip_wikitext` instead of lxml.
+"""
+import json
+import re
+import urllib2
+from urllib import urlencode
+
+from wiki_fetch import WIKI_API_URL, Fetcher, Result
+
+# maximum number of titles per request for clients without the apihighlimits
+# right
+QUERY_LIMIT = 50
+
+
+def page_title(url):
+    """
+    Get the unicode page title from a wikipedia url.
+    """
+    return urllib2.unquote(str(url.rsplit("/")[-1])).decode("utf-8")
+
+
+def query_request(request_params):
+    """
+    Build a GET request for the API with the given parameters.
+    """
+    request_params = dict((k, v.encode("utf-8") if isinstance(v, unicode) else v)
+                          for k, v in request_params.items())
+    return urllib2.Request(WIKI_API_URL + "?" + urlencode(request_params))
+
+
+def _merge_page(pages, page):
+    """
+    Merge a page from a continued response into what we already have.
+    """
+    title = page["title"]
+    if title not in pages:
+        pages[title] = page
+        return
+    seen = pages[title]
+    for key, value in page.items():
+        if key not in seen:
+            seen[key] = value
+        elif isinstance(value, list) and value != seen[key]:
+            seen[key] = seen[key] + value
+
+
+def query_pages(titles, fetch, **params):
+    """
+    Run one action=query for `titles`, following `continue` tokens.
+
+    Parameters
+    ----------
+    titles : list of unicode
+        At most `QUERY_LIMIT` titles.
+    fetch : callable
+        Takes a `urllib2.Request` and returns the response body, e.g.
+        `Fetcher.open`.
+    params
+        Extra API parameters. The defaults ask for the revision id, timestamp
+        and wikitext of the latest revision of each page.
+
+    Returns
+    -------
+    pages : dict
+        Maps each of the requested titles to its page dict from the API after
+        normalization and redirects. Missing pages have a "missing" key.
+    """
+    request_params = {
+        "action" : "query",
+        "format" : "json",
+        "redirects" : "true",
+        "prop" : "revisions",
+        "rvprop" : "ids|timestamp|content",
+        "rvslots" : "main",
+        "titles" : u"|".join(titles),
+        "continue" : "",
+        }
+    request_params.update(params)
+
+    # follow each title through normalization and redirects
+    resolved = dict((title, title) for title in titles)
+    pages = {}
+    while True:
+        json_obj = json.loads(fetch(query_request(request_params)))
+        if "error" in json_obj:
+            raise ValueError(json_obj["error"].get("info", json_obj["error"]))
+        query = json_obj.get("query", {})
+        for mapping in query.get("normalized", []) + query.get("redirects", []):
+            for title, target in resolved.items():
+                if target == mapping["from"]:
+                    resolved[title] = mapping["to"]
+        for page in query.get("pages", {}).values():
+            _merge_page(pages, page)
+        if "continue" not in json_obj:
+            break
+        request_params.update(json_obj["continue"])
+
+    return dict((title, pages.get(resolved[title], {"missing" : ""}))
+                for title in titles)
+
+
+def page_content(page):
+    """
+    Return (revid, wikitext) for the latest revision in a page dict.
+    """
+    revision = page["revisions"][0]
+    if "slots" in revision:
+        content = revision["slots"]["main"]["*"]
+    else:
+        content = revision["*"]
+    return revision["revid"], content
+
+
+_comment_pattern = re.compile(r"<!--.*?-->", re.DOTALL)
+_ref_pattern = re.compile(r"<ref[^>]*/>|<ref[^>]*>.*?</ref>",
+                          re.DOTALL | re.IGNORECASE)
+_template_pattern = re.compile(r"\{\{[^{}]*\}\}")
+_table_pattern = re.compile(r"\{\|[^{}]*?\|\}", re.DOTALL)
+_file_pattern = re.compile(r"\[\[(?:File|Image|Category):[^\[\]]*"
+                           r"(?:\[\[[^\[\]]*\]\][^\[\]]*)*\]\]",
+                           re.IGNORECASE)
+_link_pattern = re.compile(r"\[\[(?:[^|\[\]]*\|)?([^\[\]]*)\]\]")
+_external_link_pattern = re.compile(r"\[\w+://[^\s\]]*\s*([^\]]*)\]")
+_tag_pattern = re.compile(r"<[^>]+>")
+_heading_pattern = re.compile(r"^=+\s*(.*?)\s*=+\s*$", re.MULTILINE)
+_quote_pattern = re.compile(r"'{2,}")
+
+
+def strip_wikitext(text):
+    """
+    Reduce wikitext to roughly the readable text of the article.
+
+    Drops comments, references, templates (including infoboxes and navboxes),
+    tables, files and categories, and keeps the labels of links.
+    """
+    text = _comment_pattern.sub("", text)
+    text = _ref_pattern.sub("", text)
+    # templates nest, so remove from the inside out
+    n = 1
+    while n:
+        text, n = _template_pattern.subn("", text)
+    text = _table_pattern.sub("", text)
+    text = _file_pattern.sub("", text)
+    text = _link_pattern.sub(r"\1", text)
+    text = _external_link_pattern.sub(r"\1", text)
+    text = _tag_pattern.sub("", text)
+    text = _heading_pattern.sub(r"\1", text)
+    text = _quote_pattern.sub("", text)
+    return text
+
+
+def fetch_electors_batched(electors, fetcher=None, batch_size=QUERY_LIMIT):
+    """
+    Fill in the "text", "title" and "revid" of each elector dict using
+    batched action=query requests.
+
+    Batches are run concurrently through `fetcher`. Returns a list of
+    `Result` for the electors that could not be fetched.
+    """
+    if fetcher is None:
+        fetcher = Fetcher()
+    batch_size = min(batch_size, QUERY_LIMIT)
+    batches = [electors[i:i + batch_size]
+               for i in range(0, len(electors), batch_size)]
+
+    def fetch(batch):
+        titles = list(set(page_title(elector["url"]) for elector in batch))
+        return query_pages(titles, fetcher.open)
+
+    failed = []
+    for result in fetcher.map(fetch, batches):
+        for elector in result.item:
+            if result.error is not None:
+                failed.append(Result(elector, None, result.error))
+                continue
+            page = result.value[page_title(elector["url"])]
+            if "missing" in page or "invalid" in page:
+                failed.append(Result(elector, None,
+                                     KeyError("missing page %r" %
+                                              page.get("title"))))
+                continue
+            revid, content = page_content(page)
+            elector["title"] = page["title"]
+            elector["revid"] = revid
+            elector["text"] = strip_wikitext(content)
+    return failed
@@ -0,0 +1,436 @@
+"""
+Benchmarks of the text processing stages on a synthetic corpus.
+
+The only timings so far are the ad hoc ones at the bottom of wiki_text.py.
+This runs each stage of the wiki_scrape.py analysis, in its original version
+and in its replacement, on a made-up corpus that can be any size:
+
+    clean        clean_text(...).lower()          Normalizer(lowercase=True)
+    stop_words   remove_stop_words                StopWordFilter.tokens
+    ngrams       dict(combine(count(text)))       NgramCounter.text_vector
+    similarity   jaccard_similarity on all pairs  jaccard_matrix
+    end_to_end   all of the above, one after the other
+
+The corpus is generated from a seed, with words drawn from a Zipf
+distribution over a vocabulary that starts with the stop words, and with
+capitals, punctuation, numbers and dashes mixed in the way wiki text has
+them. Every stage runs in its own process, so that its peak memory can be
+measured too.
+
+    $ python wiki_bench.py --docs 500 --length 2000 --save-baseline bench.json
+    $ python wiki_bench.py --docs 500 --length 2000 --baseline bench.json
+
+With `--baseline`, it exits with status 1 if the new version of any stage
+is more than `--tolerance` slower, or uses more than `--memory-tolerance`
+more memory, than in the baseline. Its time is taken relative to the legacy
+version's time in the same run, so that a slower or busier machine does not
+look like a regression. The legacy versions are frozen, so their rows are
+reported but not checked. Times are only checked with `--repeat` of 3 or
+more.
+"""
+import gc
+import hashlib
+import json
+import subprocess
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+from wiki_similarity import jaccard_matrix, jaccard_similarity
+from wiki_text import (Normalizer, NgramCounter, StopWordFilter,
+                       all_stopwords, clean_text, combine, count,
+                       punc_pattern, remove_stop_words, space_pattern)
+from wiki_vectors import CorpusMatrix
+
+STAGES = ["clean", "stop_words", "ngrams", "similarity", "end_to_end"]
+IMPLEMENTATIONS = ["legacy", "new"]
+
+# fewer rounds than this are too noisy to fail a run on their times
+MIN_CHECKED_REPEAT = 3
+
+PUNCTUATION = [u".", u",", u";", u":", u"'s", u")", u"\"", u" \u2014"]
+
+
+def synthetic_corpus(n_docs=200, length=1000, vocabulary_size=20000,
+                     zipf=1.1, seed=0):
+    """
+    A list of `n_docs` made-up documents of about `length` words each.
+
+    Word ranks follow a Zipf distribution with exponent `zipf`. The stop
+    words are the most common words, and the rest of the vocabulary is
+    made-up lowercase words.
+    """
+    rng = np.random.RandomState(seed)
+    letters = np.array(list(u"abcdefghijklmnopqrstuvwxyz"))
+    stop_words = sorted(set(all_stopwords))
+    words = list(stop_words)
+    seen = set(words)
+    while len(words) < vocabulary_size:
+        word = u"".join(rng.choice(letters, rng.randint(3, 12)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    words = np.array(words, dtype=object)
+    ranks = np.arange(1, vocabulary_size + 1, dtype=np.float64)
+    p = ranks ** -zipf
+    p /= p.sum()
+
+    documents = []
+    for _ in range(n_docs):
+        n = rng.randint(length // 2, length * 3 // 2 + 1)
+        tokens = words[rng.choice(vocabulary_size, n, p=p)]
+        # capitals, punctuation and numbers, a few percent of the words each
+        capitals = rng.random_sample(n) < .1
+        punctuation = rng.random_sample(n) < .08
+        marks = rng.randint(len(PUNCTUATION), size=n)
+        numbers = rng.random_sample(n) < .02
+        years = rng.randint(1000, 2013, size=n)
+        parts = []
+        for i in range(n):
+            token = tokens[i]
+            if capitals[i]:
+                token = token.capitalize()
+            if numbers[i]:
+                token = u"(%d) %s" % (years[i], token)
+            if punctuation[i]:
+                token += PUNCTUATION[marks[i]]
+            parts.append(token)
+        documents.append(u" ".join(parts))
+    return documents
+
+
+def corpus_checksum(documents):
+    sha1 = hashlib.sha1()
+    for document in documents:
+        sha1.update(document.encode("utf-8"))
+    return sha1.hexdigest()
+
+
+# stages. each has a function to prepare its input from the corpus, with the
+# new implementations of the earlier stages, and the two versions to time
+
+def _cleaned(documents):
+    normalizer = Normalizer(lowercase=True)
+    return [normalizer(document) for document in documents]
+
+
+def _filtered(documents):
+    stop_filter = StopWordFilter(all_stopwords)
+    return [u" ".join(stop_filter.tokens(text))
+            for text in _cleaned(documents)]
+
+
+def _vectors(documents, similarity_docs):
+    counter = NgramCounter()
+    return [counter.text_vector(text.split())
+            for text in _filtered(documents[:similarity_docs])]
+
+
+def clean_legacy(documents):
+    return [clean_text(document, punc_pattern, space_pattern).lower()
+            for document in documents]
+
+
+def clean_new(documents):
+    normalizer = Normalizer(lowercase=True)
+    return [normalizer(document) for document in documents]
+
+
+def stop_words_legacy(texts):
+    return [remove_stop_words(text, all_stopwords) for text in texts]
+
+
+def stop_words_new(texts):
+    stop_filter = StopWordFilter(all_stopwords)
+    return [stop_filter.tokens(text) for text in texts]
+
+
+def ngrams_legacy(texts):
+    return [dict(combine(count(text))) for text in texts]
+
+
+def ngrams_new(texts):
+    counter = NgramCounter()
+    return [counter.text_vector(text.split()) for text in texts]
+
+
+def similarity_legacy(vectors):
+    n = len(vectors)
+    similarity = np.eye(n)
+    for i in range(n):
+        for j in range(i + 1, n):
+            similarity[i, j] = similarity[j, i] = jaccard_similarity(
+                vectors[i], vectors[j])
+    return similarity
+
+
+def similarity_new(vectors):
+    return jaccard_matrix(CorpusMatrix.from_dicts(vectors))
+
+
+def end_to_end_legacy(documents, similarity_docs):
+    vectors = ngrams_legacy(stop_words_legacy(clean_legacy(documents)))
+    return similarity_legacy(vectors[:similarity_docs])
+
+
+def end_to_end_new(documents, similarity_docs):
+    counter = NgramCounter()
+    vectors = [counter.text_vector(tokens) for tokens in
+               stop_words_new(clean_new(documents))]
+    return similarity_new(vectors[:similarity_docs])
+
+
+def _stage(name, implementation, documents, similarity_docs):
+    """
+    (input, function) for a stage, and the number of documents it covers.
+    """
+    if name == "clean":
+        data, n = documents, len(documents)
+    elif name == "stop_words":
+        data, n = _cleaned(documents), len(documents)
+    elif name == "ngrams":
+        data, n = _filtered(documents), len(documents)
+    elif name == "similarity":
+        data = _vectors(documents, similarity_docs)
+        n = len(data)
+    elif name == "end_to_end":
+        func = globals()["%s_%s" % (name, implementation)]
+        return (documents, lambda data: func(data, similarity_docs),
+                len(documents))
+    else:
+        raise ValueError("Unknown stage %r" % name)
+    return data, globals()["%s_%s" % (name, implementation)], n
+
+
+def _proc_status(field):
+    with open("/proc/self/status") as fin:
+        for line in fin:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+
+
+def reset_peak_rss():
+    """
+    Start measuring peak memory from the current resident memory, and return
+    that. Only Linux can reset the peak. Elsewhere the peak stays the peak
+    since the process started, which includes making the corpus.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fout:
+            fout.write("5")
+        return _proc_status("VmRSS")
+    except (IOError, OSError):
+        return peak_rss()
+
+
+def peak_rss():
+    """
+    Peak resident memory of this process in bytes.
+    """
+    try:
+        return _proc_status("VmHWM")
+    except (IOError, OSError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on OS X
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_stage(name, corpus_options, similarity_docs, repeat=3, min_time=.5):
+    """
+    Time both implementations of one stage in this process and return their
+    measurements as a dict keyed by implementation.
+
+    The implementations take turns, one timing of each per round, so that
+    they run under the same load and their ratio holds up on a busy machine.
+    Each timing runs the stage enough times to take at least `min_time`
+    seconds, as timeit does, since a single run of a few milliseconds is
+    mostly noise, and the time is the best of `repeat` rounds.
+    `peak_memory` is the growth in peak resident memory during the first
+    run, on top of the stage's input.
+    """
+    documents = synthetic_corpus(**corpus_options)
+    stages = {}
+    for implementation in IMPLEMENTATIONS:
+        stages[implementation] = _stage(name, implementation, documents,
+                                        similarity_docs)
+    n_chars = (sum(len(document) for document in documents)
+               if name in ("clean", "end_to_end") else None)
+    del documents
+    gc.collect()
+
+    numbers = {}
+    results = {}
+    for implementation in IMPLEMENTATIONS:
+        data, func, _ = stages[implementation]
+        before = reset_peak_rss()
+        started = timer()
+        func(data)
+        first = timer() - started
+        results[implementation] = {"peak_memory" : peak_rss() - before}
+        numbers[implementation] = (max(1, int(min_time / first))
+                                   if first > 0 else 1)
+        gc.collect()
+
+    best = dict((implementation, float("inf"))
+                for implementation in IMPLEMENTATIONS)
+    for _ in range(repeat):
+        for implementation in IMPLEMENTATIONS:
+            data, func, _ = stages[implementation]
+            number = numbers[implementation]
+            started = timer()
+            for _ in range(number):
+                func(data)
+            best[implementation] = min(best[implementation],
+                                       (timer() - started) / number)
+
+    for implementation, result in results.items():
+        seconds = best[implementation]
+        n_docs = stages[implementation][2]
+        result["seconds"] = seconds
+        result["docs_per_second"] = (n_docs / seconds if seconds > 0
+                                     else float("inf"))
+        if n_chars is not None:
+            result["mb_per_second"] = (n_chars / seconds / 1e6 if seconds > 0
+                                       else 0.)
+    return results
+
+
+def run_benchmarks(corpus_options, similarity_docs=100, repeat=3,
+                   stages=STAGES):
+    """
+    Run every stage in a separate process. Returns the results as a dict
+    keyed by "stage/implementation", with a "corpus" key describing the
+    corpus.
+    """
+    results = {"corpus" : dict(
+        corpus_options, similarity_docs=similarity_docs,
+        checksum=corpus_checksum(synthetic_corpus(**corpus_options)))}
+    for name in stages:
+        command = [sys.executable, __file__,
+                   "--child", name,
+                   "--options", json.dumps(corpus_options),
+                   "--similarity-docs", str(similarity_docs),
+                   "--repeat", str(repeat)]
+        output = subprocess.check_output(command)
+        stage_results = json.loads(
+            output.decode("utf-8").strip().splitlines()[-1])
+        for implementation, result in stage_results.items():
+            results["%s/%s" % (name, implementation)] = result
+    return results
+
+
+def compare(results, baseline, tolerance=.25, memory_tolerance=.25,
+            check_time=True):
+    """
+    List of (key, what, ratio) for each measurement of a new version that
+    regressed against the baseline by more than the tolerance.
+
+    Times are compared as the ratio of the new to the legacy version's time
+    of the same stage, where both runs have the legacy version.
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if not key.endswith("/new") or base is None:
+            continue
+        legacy_key = key[:-len("new")] + "legacy"
+        legacy, base_legacy = results.get(legacy_key), baseline.get(legacy_key)
+        if legacy is not None and base_legacy is not None:
+            ratio = ((result["seconds"] / legacy["seconds"]) /
+                     (base["seconds"] / base_legacy["seconds"]))
+        else:
+            ratio = result["seconds"] / base["seconds"]
+        if check_time and ratio > 1 + tolerance:
+            regressions.append((key, "time", ratio))
+        # stages that use less than a megabyte are noise, not regressions
+        base_memory = max(base["peak_memory"], 2**20)
+        if result["peak_memory"] > (1 + memory_tolerance) * base_memory:
+            regressions.append((key, "memory",
+                                float(result["peak_memory"]) / base_memory))
+    return regressions
+
+
+def format_results(results, baseline=None):
+    lines = ["%-22s %10s %12s %10s %10s %8s" % (
+        "stage", "seconds", "docs/s", "MB/s", "peak MB", "vs base")]
+    for name in STAGES:
+        for implementation in IMPLEMENTATIONS:
+            key = "%s/%s" % (name, implementation)
+            result = results.get(key)
+            if result is None:
+                continue
+            mb_per_second = result.get("mb_per_second")
+            change = ""
+            if baseline is not None and key in baseline:
+                change = "%+.0f%%" % (100 * (result["seconds"] /
+                                             baseline[key]["seconds"] - 1))
+            lines.append("%-22s %10.4f %12.1f %10s %10.1f %8s" % (
+                key, result["seconds"], result["docs_per_second"],
+                "%.2f" % mb_per_second if mb_per_second is not None else "",
+                result["peak_memory"] / 2.**20, change))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the wiki text processing stages")
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--length", type=int, default=1000,
+                        help="average words per document")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--similarity-docs", type=int, default=100,
+                        help="documents compared in the similarity stages")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--baseline", help="JSON results to compare to")
+    parser.add_argument("--save-baseline", help="write the results here")
+    parser.add_argument("--tolerance", type=float, default=.25)
+    parser.add_argument("--memory-tolerance", type=float, default=.25)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--options", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_stage(args.child, json.loads(args.options),
+                                   args.similarity_docs, args.repeat)))
+        sys.exit(0)
+
+    corpus_options = {"n_docs" : args.docs, "length" : args.length,
+                      "vocabulary_size" : args.vocabulary,
+                      "zipf" : args.zipf, "seed" : args.seed}
+    stages = [stage for stage in args.stages.split(",") if stage]
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error("unknown stage %r" % stage)
+    results = run_benchmarks(corpus_options, args.similarity_docs,
+                             args.repeat, stages)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fin:
+            baseline = json.load(fin)
+    print(format_results(results, baseline))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fout:
+            json.dump(results, fout, indent=1, sort_keys=True)
+
+    if baseline is not None:
+        if baseline.get("corpus") != results["corpus"]:
+            print("warning: the baseline was run on a different corpus")
+        check_time = args.repeat >= MIN_CHECKED_REPEAT
+        if not check_time:
+            print("warning: times are not checked with --repeat below %d"
+                  % MIN_CHECKED_REPEAT)
+        regressions = compare(results, baseline, args.tolerance,
+                              args.memory_tolerance, check_time)
+        for key, what, ratio in regressions:
+            print("regression: %s %s %.2fx the baseline" % (key, what, ratio))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,246 @@
+"""
+On-disk HTTP response cache for the Wikipedia API.
+
+Each response is stored under the sha1 of the request url, alongside a small
+JSON file with its ETag, Last-Modified, page revision id and timestamps. A
+`Session` created with a cache
+
+    >>> session = Session(cache=HTTPCache("./cache", max_age=3600))
+
+returns a cached response without touching the network while it is younger
+than `max_age`, and after that revalidates it with a conditional request, so
+an unchanged page only costs a 304 round-trip. The total size of the cached
+bodies is bounded by evicting the least recently used entries.
+
+The API does not send an ETag or Last-Modified header with action=parse
+responses, so there is nothing to make a conditional request with. Those
+entries are revalidated instead by asking action=query for the page's
+current revision id with `rvprop=ids`, a response of a few hundred bytes. If
+it is still the revid stored with the entry, the cached page is used.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib import urlencode
+from urlparse import parse_qsl, urlsplit, urlunsplit
+
+
+def wiki_revid(body):
+    """
+    Get the page revision id(s) from an API response body.
+
+    Returns the revid of an action=parse response, a dict of title to revid
+    for an action=query response, or None.
+    """
+    try:
+        json_obj = json.loads(body)
+    except ValueError:
+        return None
+    if "parse" in json_obj:
+        return json_obj["parse"].get("revid")
+    pages = json_obj.get("query", {}).get("pages", {})
+    revids = {}
+    for page in pages.values():
+        if page.get("revisions"):
+            revids[page["title"]] = page["revisions"][0]["revid"]
+    return revids or None
+
+
+def revid_check_url(url):
+    """
+    The url of an action=query request for the current revision id of the
+    page an action=parse `url` asks for, or None for other requests.
+    """
+    scheme, netloc, path, query, _ = urlsplit(url)
+    params = dict(parse_qsl(query))
+    if params.get("action") != "parse" or "page" not in params:
+        return None
+    check_params = {
+        "action" : "query",
+        "format" : "json",
+        "prop" : "revisions",
+        "rvprop" : "ids",
+        "titles" : params["page"],
+        }
+    if "redirects" in params:
+        check_params["redirects"] = params["redirects"]
+    return urlunsplit((scheme, netloc, path, urlencode(check_params), ""))
+
+
+def current_revid(body):
+    """
+    The revision id in the response to a `revid_check_url` request, or None.
+    """
+    revids = wiki_revid(body)
+    if isinstance(revids, dict) and len(revids) == 1:
+        return list(revids.values())[0]
+    return None
+
+
+class HTTPCache(object):
+    """
+    Size-bounded, least recently used on-disk cache of HTTP responses.
+
+    Parameters
+    ----------
+    directory : str
+        Where to keep the cache. Created if it does not exist.
+    max_size : int
+        Maximum total size in bytes of the cached bodies.
+    max_age : float
+        Number of seconds a response is used without revalidating it.
+    revid : callable, optional
+        Takes a response body and returns the revision id(s) to record with
+        it. Defaults to `wiki_revid`.
+    """
+    # response headers worth keeping with the body
+    keep_headers = ("content-type", "etag", "last-modified")
+
+    def __init__(self, directory, max_size=256 * 2**20, max_age=0,
+                 revid=wiki_revid):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.revid = revid
+        self.size = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def _load(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+                with open(os.path.join(dirpath, filename)) as fin:
+                    try:
+                        entries.append(json.load(fin))
+                    except ValueError:
+                        continue
+        for entry in sorted(entries, key=lambda entry: entry["accessed"]):
+            self._entries[entry["key"]] = entry
+            self.size += entry["size"]
+
+    def key(self, url):
+        return hashlib.sha1(url).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key[:2], key + ext)
+
+    def _write(self, path, data, mode="wb"):
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp = path + ".tmp"
+        with open(tmp, mode) as fout:
+            fout.write(data)
+        os.rename(tmp, path)
+
+    def get(self, key):
+        """
+        Returns (entry, body) for a cached response or None.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            try:
+                with open(self._path(key, ".body"), "rb") as fin:
+                    body = fin.read()
+            except IOError:
+                self.size -= entry["size"]
+                return None
+            entry["accessed"] = time.time()
+            self._entries[key] = entry
+            # so that eviction after a restart is by last use too
+            try:
+                self._write(self._path(key, ".json"), json.dumps(entry), "w")
+            except (IOError, OSError):
+                pass
+        return entry, body
+
+    def is_fresh(self, entry):
+        return time.time() - entry["validated"] < self.max_age
+
+    def validators(self, entry):
+        """
+        Headers for a conditional request revalidating `entry`.
+        """
+        headers = {}
+        if "etag" in entry["headers"]:
+            headers["If-None-Match"] = entry["headers"]["etag"]
+        if "last-modified" in entry["headers"]:
+            headers["If-Modified-Since"] = entry["headers"]["last-modified"]
+        return headers
+
+    def revid_check(self, entry):
+        """
+        The url to revalidate `entry` by its revision id when it has no HTTP
+        validators, or None.
+        """
+        if self.validators(entry) or not isinstance(entry.get("revid"), int):
+            return None
+        return revid_check_url(entry["url"])
+
+    def store(self, key, url, headers, body):
+        """
+        Cache a 200 response.
+        """
+        now = time.time()
+        entry = {
+            "key" : key,
+            "url" : url,
+            "headers" : dict((k, v) for k, v in headers.items()
+                             if k in self.keep_headers),
+            "revid" : self.revid(body) if self.revid else None,
+            "size" : len(body),
+            "stored" : now,
+            "validated" : now,
+            "accessed" : now,
+            }
+        with self._lock:
+            self._write(self._path(key, ".body"), body)
+            self._write(self._path(key, ".json"), json.dumps(entry), "w")
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old["size"]
+            self._entries[key] = entry
+            self.size += entry["size"]
+            self._evict()
+        return entry
+
+    def revalidated(self, key, headers):
+        """
+        Record that the server answered 304 Not Modified for `key`.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["validated"] = time.time()
+            for k in self.keep_headers:
+                if k in headers:
+                    entry["headers"][k] = headers[k]
+            self._write(self._path(key, ".json"), json.dumps(entry), "w")
+
+    def _evict(self):
+        while self.size > self.max_size and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self.size -= entry["size"]
+            for ext in (".body", ".json"):
+                try:
+                    os.remove(self._path(key, ext))
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
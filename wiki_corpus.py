@@ -0,0 +1,179 @@
+"""
+Compact binary corpus format that can be memory-mapped.
+
+`json.dump(electors, json_out)` stores every document as Python objects, and
+`json.load` has to parse all of it even when only a few documents are needed.
+A corpus directory instead holds
+
+    tokens.bin   int32 token ids of all documents, one after the other
+    offsets.bin  int64 offsets into tokens.bin, n_docs + 1 of them
+    vocab.txt    the tokens, one per line, line number = token id
+    meta.json    format information and a metadata dict per document
+
+`CorpusReader` opens the two arrays with `numpy.memmap`, so opening a corpus
+reads only the small metadata and looking at one document touches only its
+slice of the token file.
+
+    >>> with CorpusWriter("electors05") as writer:
+    ...     for elector in electors:
+    ...         writer.write(stop_filter.tokens(normalizer(elector["text"])),
+    ...                      {"name" : elector["name"], "url" : elector["url"]})
+    >>> corpus = CorpusReader("electors05")
+    >>> corpus.text_vector(0)
+"""
+import codecs
+import json
+import os
+from array import array
+
+import numpy as np
+
+from wiki_text import NgramCounter
+
+FORMAT_VERSION = 1
+
+# fields that are not kept as metadata when writing pipeline documents
+_BULKY_FIELDS = frozenset(["html", "text", "tokens", "text_vector"])
+
+
+class CorpusWriter(object):
+    """
+    Writes documents as lists of tokens to a corpus directory.
+
+    Can be used as a `wiki_pipeline` sink for documents with "tokens".
+    """
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.token_ids = {}
+        self.vocabulary = []
+        self.offsets = array("l", [0])
+        self.metadata = []
+        self._tokens = open(os.path.join(path, "tokens.bin"), "wb")
+        self._closed = False
+
+    def write(self, tokens, meta=None):
+        """
+        Append a document given as a list of tokens with an optional dict of
+        JSON-serializable metadata.
+        """
+        token_ids = self.token_ids
+        ids = array("i")
+        for token in tokens:
+            token_id = token_ids.get(token)
+            if token_id is None:
+                token_id = token_ids[token] = len(self.vocabulary)
+                self.vocabulary.append(token)
+            ids.append(token_id)
+        ids.tofile(self._tokens)
+        self.offsets.append(self.offsets[-1] + len(ids))
+        self.metadata.append(meta or {})
+
+    def add(self, doc):
+        """
+        Sink interface. Writes doc["tokens"], keeping the other small fields
+        as metadata.
+        """
+        meta = dict((k, v) for k, v in doc.items() if k not in _BULKY_FIELDS)
+        self.write(doc["tokens"], meta)
+
+    def close(self):
+        if self._closed:
+            return self.path
+        self._tokens.close()
+        with open(os.path.join(self.path, "offsets.bin"), "wb") as fout:
+            np.array(self.offsets, dtype=np.int64).tofile(fout)
+        with codecs.open(os.path.join(self.path, "vocab.txt"), "w",
+                         "utf-8") as fout:
+            for token in self.vocabulary:
+                fout.write(token)
+                fout.write(u"\n")
+        with open(os.path.join(self.path, "meta.json"), "w") as fout:
+            json.dump({"version" : FORMAT_VERSION,
+                       "token_dtype" : "int32",
+                       "offset_dtype" : "int64",
+                       "n_docs" : len(self.metadata),
+                       "n_tokens" : self.offsets[-1],
+                       "n_vocab" : len(self.vocabulary),
+                       "docs" : self.metadata}, fout)
+        self._closed = True
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CorpusReader(object):
+    """
+    Random access to the documents in a corpus directory.
+
+    Attributes
+    ----------
+    token_ids : np.memmap
+        All of the token ids.
+    offsets : np.memmap
+        Document i is `token_ids[offsets[i]:offsets[i+1]]`.
+    metadata : list of dict
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as fin:
+            info = json.load(fin)
+        if info["version"] != FORMAT_VERSION:
+            raise ValueError("Unknown corpus format version %s" %
+                             info["version"])
+        self.metadata = info["docs"]
+        self.n_vocab = info["n_vocab"]
+        self.offsets = np.memmap(os.path.join(path, "offsets.bin"),
+                                 dtype=info["offset_dtype"], mode="r")
+        if info["n_tokens"]:
+            self.token_ids = np.memmap(os.path.join(path, "tokens.bin"),
+                                       dtype=info["token_dtype"], mode="r")
+        else:
+            # numpy cannot map an empty file
+            self.token_ids = np.zeros(0, dtype=info["token_dtype"])
+        self._vocabulary = None
+
+    @property
+    def vocabulary(self):
+        """
+        List of the tokens, read on first use.
+        """
+        if self._vocabulary is None:
+            with codecs.open(os.path.join(self.path, "vocab.txt"), "r",
+                             "utf-8") as fin:
+                self._vocabulary = fin.read().split(u"\n")[:self.n_vocab]
+        return self._vocabulary
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def ids(self, i):
+        """
+        The token ids of document i as a read-only array.
+        """
+        return self.token_ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def tokens(self, i):
+        vocabulary = self.vocabulary
+        return [vocabulary[j] for j in self.ids(i).tolist()]
+
+    def text(self, i):
+        return u" ".join(self.tokens(i))
+
+    def text_vector(self, i, ngram_range=(1, 3)):
+        """
+        The n-gram counts of document i as a text_vector dict.
+        """
+        counts = NgramCounter(ngram_range).count_ids(self.ids(i).tolist())
+        vocabulary = self.vocabulary
+        return dict((u" ".join([vocabulary[j] for j in ngram_ids]), n)
+                    for ngram_ids, n in counts.items())
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.ids(i)
@@ -0,0 +1,91 @@
+"""
+Streaming text extraction from the HTML returned by the Wikipedia API.
+
+wiki_scrape.py builds the whole lxml tree for every page only to flatten it
+again with `text_content()`. Here the parser is given a target object instead,
+so no elements are created. Text is emitted in chunks as the HTML is fed in,
+and boilerplate subtrees such as tables, navboxes, references and edit links
+are skipped as they are parsed.
+
+    >>> text = extract_text(json_obj["parse"]["text"]["*"])
+"""
+from lxml import etree
+
+# tags whose whole subtree is dropped
+SKIP_TAGS = frozenset(["table", "style", "script"])
+
+# classes whose whole subtree is dropped
+SKIP_CLASSES = frozenset(["navbox", "vertical-navbox", "reflist", "references",
+                          "reference", "mw-editsection", "toc", "metadata",
+                          "noprint", "mw-references-wrap"])
+
+
+class TextTarget(object):
+    """
+    Parser target that collects the text outside of skipped subtrees.
+    """
+    def __init__(self, skip_tags=SKIP_TAGS, skip_classes=SKIP_CLASSES):
+        self.skip_tags = frozenset(skip_tags)
+        self.skip_classes = frozenset(skip_classes)
+        self.chunks = []
+        # depth inside a skipped subtree, 0 when not skipping
+        self._skipping = 0
+
+    def start(self, tag, attrib):
+        if self._skipping:
+            self._skipping += 1
+        elif (tag in self.skip_tags or
+              self.skip_classes.intersection(attrib.get("class", "").split())):
+            self._skipping = 1
+
+    def end(self, tag):
+        if self._skipping:
+            self._skipping -= 1
+
+    def data(self, data):
+        if not self._skipping:
+            self.chunks.append(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def iter_text(text, skip_tags=SKIP_TAGS, skip_classes=SKIP_CLASSES,
+              chunk_size=16384):
+    """
+    Generator that yields the text in an HTML string as it is parsed.
+
+    Parameters
+    ----------
+    text : str or unicode
+        The HTML. Byte strings are assumed to be utf-8.
+    skip_tags : iterable
+        Tags whose subtrees are dropped.
+    skip_classes : iterable
+        Classes whose subtrees are dropped.
+    chunk_size : int
+        Number of characters fed to the parser at a time.
+    """
+    target = TextTarget(skip_tags, skip_classes)
+    parser = etree.HTMLParser(target=target, encoding="utf-8")
+    for i in range(0, len(text), chunk_size):
+        parser.feed(text[i:i + chunk_size])
+        for chunk in target.chunks:
+            yield chunk
+        del target.chunks[:]
+    for chunk in parser.close():
+        yield chunk
+
+
+def extract_text(text, skip_tags=SKIP_TAGS, skip_classes=SKIP_CLASSES):
+    """
+    Return the text in an HTML string, without the skipped subtrees.
+
+    With empty `skip_tags` and `skip_classes` this gives the same text as
+    `etree.HTML(text).text_content()`.
+    """
+    return u"".join(iter_text(text, skip_tags, skip_classes))
@@ -0,0 +1,412 @@
+"""
+Concurrent, rate-limited fetching of pages from the Wikipedia API.
+
+The elector loop in wiki_scrape.py waits on one `opener.open` call at a time.
+`Fetcher` runs the same requests through a bounded pool of worker threads,
+spaces out the requests made to each host, and returns the results in the
+order they were asked for, with any error attached to the page that raised it.
+
+    >>> fetcher = Fetcher(max_workers=8, requests_per_second=10)
+    >>> failed = fetch_electors(electors, fetcher)
+
+By default the fetcher sends its requests through a `Session`, which keeps
+HTTP/1.1 connections open between requests to the same host and asks for
+gzip/deflate compressed responses. Give the session a `wiki_cache.HTTPCache`
+to keep responses on disk between runs.
+"""
+import httplib
+import json
+import socket
+import threading
+import time
+import urllib2
+import zlib
+from collections import namedtuple
+from Queue import Queue, Empty
+from urllib import urlencode
+from urlparse import urljoin, urlsplit
+
+from wiki_cache import current_revid
+from wiki_extract import extract_text
+
+WIKI_API_URL = "http://en.wikipedia.org/w/api.php"
+USER_AGENT = "WikiApiDemo/0.0 +http://jseabold.net"
+
+# item is the input, value is what the function returned, error is the
+# exception it raised (if any)
+Result = namedtuple("Result", ["item", "value", "error"])
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+def decode_body(body, content_encoding):
+    """
+    Decompress a response body sent with gzip or deflate content-encoding.
+    """
+    content_encoding = (content_encoding or "").lower()
+    if content_encoding in ("gzip", "x-gzip"):
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    elif content_encoding == "deflate":
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # some servers send raw deflate without the zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+class Response(object):
+    """
+    A fully read HTTP response. Quacks enough like the object returned by
+    `urllib2.urlopen` for our purposes.
+    """
+    def __init__(self, url, code, headers, body):
+        self.url = url
+        self.code = code
+        self.headers = headers
+        self.body = body
+
+    def read(self):
+        return self.body
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+
+class Session(object):
+    """
+    Reuses persistent HTTP/1.1 connections across requests to the same host.
+
+    Idle connections are kept in a pool per host, so the session can be
+    shared by the worker threads of a `Fetcher`. Every request sends the
+    session `headers`, which by default set our User-Agent and ask for a
+    gzip or deflate compressed response. Compressed bodies are decompressed
+    transparently and redirects are followed.
+
+    With a `cache`, GET responses are stored on disk and reused. A cached
+    response younger than the cache's `max_age` is returned as is, an older
+    one is revalidated with a conditional request, or for action=parse
+    responses, which come without validators, by checking the page's
+    current revision id.
+
+    Parameters
+    ----------
+    headers : dict, optional
+        Headers to send with every request in addition to the defaults.
+    timeout : float
+        Socket timeout in seconds.
+    max_idle : int
+        Maximum number of idle connections to keep per host.
+    cache : wiki_cache.HTTPCache, optional
+        Response cache.
+    limiter : RateLimiter, optional
+        Waited on before every request sent to the network, including
+        redirects and revalidations but not responses served from the cache.
+        A `Fetcher` gives its session its own limiter.
+    """
+    def __init__(self, headers=None, timeout=30, max_idle=8, cache=None,
+                 limiter=None):
+        self.headers = {
+            "User-Agent" : USER_AGENT,
+            "Accept-Encoding" : "gzip, deflate",
+            "Connection" : "keep-alive",
+            }
+        if headers:
+            self.headers.update(headers)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.cache = cache
+        self.limiter = limiter
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme, netloc):
+        """
+        Returns (connection, reused) for the host.
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        if scheme == "https":
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _release(self, scheme, netloc, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def request(self, method, url, data=None, headers=None):
+        """
+        Make a request and return a `Response` with the decoded body.
+        """
+        if self.cache is None or method != "GET":
+            return self._follow(method, url, data, headers)
+
+        key = self.cache.key(url)
+        cached = self.cache.get(key)
+        if cached is not None:
+            entry, body = cached
+            if self.cache.is_fresh(entry):
+                return Response(url, 200, entry["headers"], body)
+            if self._same_revision(entry):
+                self.cache.revalidated(key, {})
+                return Response(url, 200, entry["headers"], body)
+            headers = dict(headers or {})
+            headers.update(self.cache.validators(entry))
+
+        response = self._follow(method, url, data, headers)
+        if response.code == 304 and cached is not None:
+            self.cache.revalidated(key, response.headers)
+            return Response(url, 200, entry["headers"], body)
+        elif response.code == 200:
+            self.cache.store(key, url, response.headers, response.body)
+        return response
+
+    def _same_revision(self, entry):
+        """
+        Whether the page of a cached action=parse response without HTTP
+        validators is still at the revision it was cached at.
+        """
+        check_url = self.cache.revid_check(entry)
+        if check_url is None:
+            return False
+        try:
+            response = self._follow("GET", check_url, None, None)
+        except (httplib.HTTPException, socket.error):
+            return False
+        return (response.code == 200 and
+                current_revid(response.body) == entry["revid"])
+
+    def _follow(self, method, url, data, headers):
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request(method, url, data, headers)
+            if response.code not in REDIRECT_CODES:
+                return response
+            url = urljoin(url, response.headers["location"])
+            if response.code == 303:
+                method, data = "GET", None
+        raise urllib2.HTTPError(url, response.code, "Too many redirects",
+                                response.headers, None)
+
+    def _request(self, method, url, data, headers):
+        scheme, netloc, path, query, _ = urlsplit(url)
+        path = path or "/"
+        if query:
+            path += "?" + query
+        # urllib2 capitalizes header names as "User-agent", so normalize them
+        # before merging to avoid sending a header twice
+        request_headers = dict((k.title(), v) for k, v in self.headers.items())
+        if data is not None:
+            request_headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if headers:
+            request_headers.update((k.title(), v) for k, v in headers.items())
+
+        if self.limiter is not None:
+            self.limiter.wait(netloc)
+        while True:
+            connection, reused = self._connection(scheme, netloc)
+            try:
+                connection.request(method, path, data, request_headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                # the server may have dropped an idle connection, so try
+                # again once on a fresh one
+                if reused:
+                    continue
+                raise
+            break
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(scheme, netloc, connection)
+        response_headers = dict((k.lower(), v)
+                                for k, v in response.getheaders())
+        body = decode_body(body, response_headers.get("content-encoding"))
+        return Response(url, response.status, response_headers, body)
+
+    def open(self, request):
+        """
+        Open a `urllib2.Request` like `OpenerDirector.open` does.
+
+        Raises `urllib2.HTTPError` for error responses.
+        """
+        response = self.request(request.get_method(), request.get_full_url(),
+                                request.get_data(), dict(request.header_items()))
+        if response.code >= 400:
+            raise urllib2.HTTPError(response.url, response.code,
+                                    httplib.responses.get(response.code, ""),
+                                    response.headers, None)
+        return response
+
+
+class RateLimiter(object):
+    """
+    Limits how many requests are started per second against each host.
+
+    Each call to `wait` reserves the next free slot for the host and sleeps
+    until it comes up, so concurrent callers are spread out evenly.
+    """
+    def __init__(self, requests_per_second=None):
+        self.requests_per_second = requests_per_second
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        if not self.requests_per_second:
+            return
+        interval = 1. / self.requests_per_second
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Fetcher(object):
+    """
+    A bounded pool of worker threads for fetching pages.
+
+    Parameters
+    ----------
+    opener : Session, optional
+        Anything with an `open(request)` method returning a file-like object,
+        such as a `urllib2.OpenerDirector`. Defaults to a new `Session`.
+    max_workers : int
+        Maximum number of requests in flight at once.
+    requests_per_second : float, optional
+        Maximum request rate per host. No limit if None. A `Session` applies
+        the limit to every request it sends, so that cache revalidations
+        count and cache hits do not.
+    """
+    def __init__(self, opener=None, max_workers=8, requests_per_second=None):
+        if opener is None:
+            opener = Session()
+        self.opener = opener
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(requests_per_second)
+        if isinstance(opener, Session) and opener.limiter is None:
+            opener.limiter = self.limiter
+
+    def open(self, request):
+        """
+        Fetch a single `urllib2.Request`, respecting the rate limit, and
+        return the body.
+        """
+        if getattr(self.opener, "limiter", None) is not self.limiter:
+            host = urlsplit(request.get_full_url()).netloc
+            self.limiter.wait(host)
+        return self.opener.open(request).read()
+
+    def map(self, func, items):
+        """
+        Call `func` on every item using the worker pool.
+
+        Returns a list of `Result` in the same order as `items`. An exception
+        raised for one item is stored on its `Result` and does not stop the
+        others.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        tasks = Queue()
+        for i, item in enumerate(items):
+            tasks.put((i, item))
+
+        def work():
+            while True:
+                try:
+                    i, item = tasks.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[i] = Result(item, func(item), None)
+                except Exception as err:
+                    results[i] = Result(item, None, err)
+
+        threads = []
+        for _ in range(min(self.max_workers, len(items))):
+            thread = threading.Thread(target=work)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return results
+
+    def fetch_all(self, requests):
+        """
+        Fetch all of `requests`. Returns a list of `Result` whose value is
+        the response body.
+        """
+        return self.map(self.open, requests)
+
+
+def parse_request(url):
+    """
+    Build the action=parse API request for a wikipedia page url.
+
+    This is a GET request, unlike in wiki_scrape.py, so that it can be cached.
+    """
+    page = urllib2.unquote(url.rsplit("/")[-1])
+    request_params = {
+        "action" : "parse",
+        "format" : "json",
+        "redirects" : "true",
+        "page" : page,
+        }
+    return urllib2.Request(WIKI_API_URL + "?" + urlencode(request_params))
+
+
+def page_text(json_page):
+    """
+    Pull the text out of the rendered HTML in an action=parse response,
+    leaving out tables, navboxes, references and edit links.
+    """
+    json_obj = json.loads(json_page)
+    if "error" in json_obj:
+        raise ValueError(json_obj["error"].get("info", json_obj["error"]))
+    return extract_text(json_obj["parse"]["text"]["*"])
+
+
+def fetch_electors(electors, fetcher=None):
+    """
+    Fill in the "text" of each elector dict using the worker pool.
+
+    Returns a list of `Result` for the electors that could not be fetched.
+    Those electors are left without a "text" key.
+    """
+    if fetcher is None:
+        fetcher = Fetcher()
+
+    def fetch(elector):
+        return page_text(fetcher.open(parse_request(elector["url"])))
+
+    failed = []
+    for result in fetcher.map(fetch, electors):
+        if result.error is None:
+            result.item["text"] = result.value
+        else:
+            failed.append(result)
+    return failed
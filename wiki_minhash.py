@@ -0,0 +1,188 @@
+"""
+MinHash signatures and a banded LSH index for approximate near neighbours.
+
+Exact Jaccard similarity between every pair of pages does not scale past a
+few thousand documents. A MinHash signature of a document's n-gram set is a
+short vector whose agreement with another signature estimates the Jaccard
+similarity of the two sets. Splitting the signatures into bands and hashing
+each band finds the likely similar documents without comparing every pair:
+
+    >>> minhash = MinHash(num_perm=128)
+    >>> index = LSHIndex(bands=32, rows=4, num_perm=minhash.num_perm)
+    >>> for elector in electors:
+    ...     index.insert(elector["name"],
+    ...                  minhash.signature(elector["text_vector"]))
+    >>> index.query(minhash.signature(electors[0]["text_vector"]))
+
+Two documents with Jaccard similarity s share at least one band with
+probability 1 - (1 - s**rows)**bands. More rows per band raise precision,
+more bands raise recall. `LSHIndex.threshold` gives the similarity at which
+the curve is steepest.
+"""
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+# universal hashing h(x) = (a*x + b) % PRIME with a, b, x < 2**31 keeps a*x
+# inside of uint64
+PRIME = np.uint64((1 << 31) - 1)
+
+
+def hash_ngrams(ngrams):
+    """
+    Hash n-gram strings to integers in [0, PRIME).
+    """
+    hashes = [zlib.crc32(ngram.encode("utf-8")) & 0xffffffff
+              for ngram in ngrams]
+    return np.array(hashes, dtype=np.uint64) % PRIME
+
+
+class MinHash(object):
+    """
+    Computes MinHash signatures with `num_perm` random hash functions.
+
+    Parameters
+    ----------
+    num_perm : int
+        Length of the signatures.
+    seed : int
+        Seed for the hash functions. Only signatures made with the same
+        seed and `num_perm` can be compared.
+    chunk_size : int
+        Number of n-grams hashed at once. Each chunk uses a
+        num_perm x chunk_size array.
+    """
+    def __init__(self, num_perm=128, seed=1, chunk_size=4096):
+        prng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = prng.randint(1, int(PRIME), num_perm).astype(np.uint64)
+        self.b = prng.randint(0, int(PRIME), num_perm).astype(np.uint64)
+        self.chunk_size = chunk_size
+
+    def signature_from_hashes(self, hashes):
+        """
+        Signature of a set of integers in [0, PRIME).
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        signature = np.empty(self.num_perm, dtype=np.uint64)
+        signature.fill(PRIME)
+        a = self.a[:, None]
+        b = self.b[:, None]
+        for start in range(0, len(hashes), self.chunk_size):
+            chunk = hashes[start:start + self.chunk_size]
+            permuted = (a * chunk + b) % PRIME
+            np.minimum(signature, permuted.min(axis=1), out=signature)
+        return signature
+
+    def signature(self, ngrams):
+        """
+        Signature of an iterable of n-gram strings, such as a text_vector
+        dict. `count` yields (n-gram, 1) pairs, so pass
+        `(ngram for ngram, _ in count(text))`.
+        """
+        return self.signature_from_hashes(hash_ngrams(ngrams))
+
+    def signatures(self, documents):
+        """
+        Signatures of many n-gram sets as an n_docs x num_perm array.
+        """
+        return np.array([self.signature(ngrams) for ngrams in documents],
+                        dtype=np.uint64).reshape(-1, self.num_perm)
+
+    def matrix_signatures(self, matrix):
+        """
+        Signatures of the rows of a `CorpusMatrix`, hashing the column ids
+        instead of the n-gram strings.
+        """
+        return np.array([self.signature_from_hashes(matrix.row(i)[0])
+                         for i in range(len(matrix))],
+                        dtype=np.uint64).reshape(-1, self.num_perm)
+
+
+def estimate_jaccard(signature1, signature2):
+    """
+    Estimate the Jaccard similarity of two sets from their signatures.
+    """
+    return np.mean(signature1 == signature2)
+
+
+def collision_probability(similarity, bands, rows):
+    """
+    Probability that two documents with the given Jaccard similarity share
+    at least one band.
+    """
+    return 1. - (1. - similarity ** rows) ** bands
+
+
+class LSHIndex(object):
+    """
+    Banded locality sensitive hashing index over MinHash signatures.
+
+    Parameters
+    ----------
+    bands : int
+        Number of bands.
+    rows : int
+        Number of signature values per band. Signatures must have at least
+        bands * rows values.
+    num_perm : int, optional
+        Length of the signatures, to check `bands` and `rows` against.
+    """
+    def __init__(self, bands=32, rows=4, num_perm=None):
+        if num_perm is not None and bands * rows > num_perm:
+            raise ValueError("%d bands of %d rows need signatures of at least "
+                             "%d values, not %d" % (bands, rows, bands * rows,
+                                                    num_perm))
+        self.bands = bands
+        self.rows = rows
+        self.tables = [defaultdict(list) for _ in range(bands)]
+        self.keys = set()
+
+    @property
+    def threshold(self):
+        """
+        Approximate similarity above which documents become candidates.
+        """
+        return (1. / self.bands) ** (1. / self.rows)
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        if len(signature) < self.bands * rows:
+            # the missing bands would all be empty and match every document
+            raise ValueError("Signature has %d values, %d bands of %d rows "
+                             "need %d" % (len(signature), self.bands, rows,
+                                          self.bands * rows))
+        for i in range(self.bands):
+            yield signature[i * rows:(i + 1) * rows].tobytes()
+
+    def insert(self, key, signature):
+        for table, band_key in zip(self.tables, self._band_keys(signature)):
+            table[band_key].append(key)
+        self.keys.add(key)
+
+    def query(self, signature):
+        """
+        Returns the set of keys sharing at least one band with `signature`.
+        """
+        candidates = set()
+        for table, band_key in zip(self.tables, self._band_keys(signature)):
+            candidates.update(table.get(band_key, ()))
+        return candidates
+
+    def candidate_pairs(self):
+        """
+        Returns the set of all pairs of keys sharing at least one band.
+        """
+        pairs = set()
+        for table in self.tables:
+            for keys in table.values():
+                for i, key1 in enumerate(keys):
+                    for key2 in keys[i + 1:]:
+                        if key1 != key2:
+                            pairs.add((key1, key2) if key1 < key2
+                                      else (key2, key1))
+        return pairs
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,324 @@
+"""
+Streaming pipeline from fetching pages to n-gram vectors.
+
+In wiki_scrape.py each step builds the whole `electors` list again, with the
+raw text, then the cleaned text, then the vectors, so the whole corpus is in
+memory at every step. A `Pipeline` instead passes documents one at a time
+through a chain of stages, each running in its own thread(s) and connected to
+the next by a bounded queue. Memory use depends on the number of documents in
+flight, not on the size of the corpus, and the results go to a sink:
+
+    >>> pipeline = wiki_pipeline(Fetcher(max_workers=8), fetch_workers=8)
+    >>> matrix, names = pipeline.run(electors, MatrixSink())
+
+A stage is any function that takes a document dict and returns it, or returns
+None to drop it. A sink has `add(doc)` and `close()` methods, and `run`
+returns whatever `close` returns.
+"""
+import json
+import threading
+from Queue import Queue, Empty, Full
+
+from wiki_extract import extract_text
+from wiki_fetch import parse_request
+from wiki_text import Normalizer, NgramCounter, StopWordFilter
+from wiki_vectors import MatrixBuilder
+
+# marks the end of the stream in the queues
+_DONE = object()
+
+
+class Pipeline(object):
+    """
+    A chain of document stages connected by bounded queues.
+
+    Parameters
+    ----------
+    maxsize : int
+        Size of the queue in front of each stage and of the sink.
+
+    Attributes
+    ----------
+    errors : list
+        (stage name, document, exception) for each document dropped because
+        a stage raised.
+    """
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.stages = []
+        self.errors = []
+        self._stopped = threading.Event()
+
+    def add(self, func, workers=1, name=None):
+        """
+        Append a stage run by `workers` threads. Documents can come out of a
+        stage with more than one worker in a different order.
+        """
+        self.stages.append((name or func.__name__, func, workers))
+        return self
+
+    def _feed(self, source, queue, n_done):
+        try:
+            for doc in source:
+                if self._stopped.is_set():
+                    return
+                queue.put(doc)
+        except Exception as err:
+            self.errors.append(("source", None, err))
+        for _ in range(n_done):
+            queue.put(_DONE)
+
+    def _work(self, name, func, inbox, outbox, finished, n_done):
+        while True:
+            doc = inbox.get()
+            if doc is _DONE:
+                break
+            if self._stopped.is_set():
+                continue
+            try:
+                doc = func(doc)
+            except Exception as err:
+                self.errors.append((name, doc, err))
+                continue
+            if doc is not None:
+                outbox.put(doc)
+        # the last worker of a stage to finish passes the end on
+        if finished():
+            for _ in range(n_done):
+                outbox.put(_DONE)
+
+    def run(self, source, sink):
+        """
+        Run every document from the iterable `source` through the stages
+        into `sink` and return `sink.close()`.
+
+        If `sink.add` raises, the stages are stopped before the exception is
+        raised again, and the sink is not closed.
+        """
+        del self.errors[:]
+        self._stopped.clear()
+        queues = [Queue(self.maxsize) for _ in range(len(self.stages) + 1)]
+        # number of end markers each queue needs, one per reader
+        readers = [workers for _, _, workers in self.stages] + [1]
+
+        threads = [threading.Thread(target=self._feed,
+                                    args=(source, queues[0], readers[0]))]
+        for i, (name, func, workers) in enumerate(self.stages):
+            finished = _Countdown(workers)
+            for _ in range(workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(name, func, queues[i], queues[i + 1], finished,
+                          readers[i + 1])))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        results = queues[-1]
+        try:
+            while True:
+                doc = results.get()
+                if doc is _DONE:
+                    break
+                sink.add(doc)
+        except:
+            self._stop(queues, readers, threads)
+            raise
+        for thread in threads:
+            thread.join()
+        return sink.close()
+
+    def _stop(self, queues, readers, threads):
+        # the stages drop what they read from now on. empty the queues so
+        # that threads blocked on a full one go on, and put end markers in
+        # them so that threads waiting on an empty one finish
+        self._stopped.set()
+        while True:
+            for queue, n_done in zip(queues, readers):
+                for _ in range(n_done):
+                    try:
+                        queue.put_nowait(_DONE)
+                    except Full:
+                        break
+            threads = [thread for thread in threads if thread.is_alive()]
+            for thread in threads:
+                thread.join(.05)
+            if not any(thread.is_alive() for thread in threads):
+                break
+            for queue in queues:
+                try:
+                    while True:
+                        queue.get_nowait()
+                except Empty:
+                    pass
+
+
+class _Countdown(object):
+    """
+    Thread-safe counter that returns True when called for the last time.
+    """
+    def __init__(self, n):
+        self.n = n
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.n -= 1
+            return self.n == 0
+
+
+# stages
+
+def fetch_stage(fetcher):
+    """
+    Fetch the rendered HTML of the document's "url" into "html".
+    """
+    def fetch(doc):
+        json_obj = json.loads(fetcher.open(parse_request(doc["url"])))
+        if "error" in json_obj:
+            raise ValueError(json_obj["error"].get("info", json_obj["error"]))
+        doc["html"] = json_obj["parse"]["text"]["*"]
+        return doc
+    return fetch
+
+
+def extract_stage(**kwargs):
+    """
+    Replace "html" with the "text" from `wiki_extract.extract_text`.
+    """
+    def extract(doc):
+        doc["text"] = extract_text(doc.pop("html"), **kwargs)
+        return doc
+    return extract
+
+
+def clean_stage(normalizer=None):
+    """
+    Normalize the "text". Defaults to `Normalizer(lowercase=True)`.
+    """
+    if normalizer is None:
+        normalizer = Normalizer(lowercase=True)
+
+    def clean(doc):
+        doc["text"] = normalizer(doc["text"])
+        return doc
+    return clean
+
+
+def stop_filter_stage(stop_filter=None):
+    """
+    Replace "text" with the "tokens" that are not stop words.
+    """
+    if stop_filter is None:
+        stop_filter = StopWordFilter()
+
+    def stop_filter_(doc):
+        doc["tokens"] = stop_filter.tokens(doc.pop("text"))
+        return doc
+    return stop_filter_
+
+
+def ngram_stage(counter=None):
+    """
+    Replace "tokens" with the "text_vector" of n-gram counts.
+
+    The counter is not thread-safe, so run this stage with one worker.
+    """
+    if counter is None:
+        counter = NgramCounter()
+
+    def ngrams(doc):
+        doc["text_vector"] = counter.text_vector(doc.pop("tokens"))
+        return doc
+    return ngrams
+
+
+def wiki_pipeline(fetcher, fetch_workers=4, maxsize=16, normalizer=None,
+                  stop_filter=None, counter=None):
+    """
+    The fetch -> extract -> clean -> stop word -> n-gram pipeline for
+    elector dicts with a "url".
+    """
+    pipeline = Pipeline(maxsize)
+    pipeline.add(fetch_stage(fetcher), workers=fetch_workers, name="fetch")
+    pipeline.add(extract_stage(), name="extract")
+    pipeline.add(clean_stage(normalizer), name="clean")
+    pipeline.add(stop_filter_stage(stop_filter), name="stop_filter")
+    pipeline.add(ngram_stage(counter), name="ngrams")
+    return pipeline
+
+
+# sinks
+
+class ListSink(object):
+    """
+    Collects the documents in a list.
+    """
+    def __init__(self):
+        self.docs = []
+
+    def add(self, doc):
+        self.docs.append(doc)
+
+    def close(self):
+        return self.docs
+
+
+class JSONLinesSink(object):
+    """
+    Writes each document as a line of JSON. Returns the number written.
+    """
+    def __init__(self, path):
+        self.fout = open(path, "w")
+        self.count = 0
+
+    def add(self, doc):
+        self.fout.write(json.dumps(doc))
+        self.fout.write("\n")
+        self.count += 1
+
+    def close(self):
+        self.fout.close()
+        return self.count
+
+
+class MongoSink(object):
+    """
+    Inserts the documents into a MongoDB collection in batches with a
+    `firehose_writer.BulkWriter`. Returns the number inserted.
+
+    `writer_options` go to the `BulkWriter`, e.g. `w` or `ordered`.
+    """
+    def __init__(self, collection, batch_size=100, **writer_options):
+        # only this sink needs pymongo
+        from firehose_writer import BulkWriter
+        self.writer = BulkWriter(collection, batch_size=batch_size,
+                                 **writer_options)
+
+    def add(self, doc):
+        self.writer.add(doc)
+
+    def flush(self):
+        return self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+        return self.writer.written
+
+
+class MatrixSink(object):
+    """
+    Adds each document's "text_vector" to a `CorpusMatrix`, keeping only the
+    `key` of each document. Returns (matrix, keys).
+    """
+    def __init__(self, vocabulary=None, key="name"):
+        self.builder = MatrixBuilder(vocabulary)
+        self.key = key
+        self.keys = []
+
+    def add(self, doc):
+        self.builder.add(doc["text_vector"])
+        self.keys.append(doc.get(self.key))
+
+    def close(self):
+        return self.builder.build(), self.keys
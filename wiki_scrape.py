@@ -748,7 +748,7 @@ def jaccard_similarity(vector1, vector2):
     # checking for set membership is fast
     keys1 = set(vector1.keys())
     keys2 = set(vector2.keys())
-    all_keys = keys1.union(keys)
+    all_keys = keys1.union(keys2)
     union = len(all_keys)
     intersection = 0.
     for key in all_keys:
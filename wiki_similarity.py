@@ -0,0 +1,195 @@
+"""
+All-pairs similarity between the documents of a corpus.
+
+`jaccard_similarity`, from wiki_scrape.py, compares two text_vector dicts with
+Python sets, so comparing every elector with every other is O(N**2) pure
+Python. `jaccard_matrix` computes the whole N x N matrix from a sparse
+document-term matrix with sparse matrix products instead, a block of rows at a
+time so that memory stays bounded for large corpora:
+
+    >>> matrix = CorpusMatrix.from_dicts(e["text_vector"] for e in electors)
+    >>> similarity = jaccard_matrix(matrix)
+
+Pass an `np.memmap` as `out` when even the result is too big for memory.
+
+`jaccard_similarity` here is a frozen copy of the one in wiki_scrape.py,
+which still defines it. It is kept only as the baseline for wiki_bench.py,
+because wiki_scrape.py runs the whole scrape when it is imported.
+
+`top_k_cosine` finds the most similar documents by cosine similarity of
+L2-normalized rows, such as those from `TfidfWeighter.transform`. It keeps
+only the best k per row of each block, so the N x N matrix is never built:
+
+    >>> weights = TfidfWeighter().update(matrix).transform(matrix)
+    >>> indices, scores = top_k_cosine(weights, k=5, exclude_self=True)
+"""
+import numpy as np
+from scipy import sparse
+
+
+def jaccard_similarity(vector1, vector2):
+    '''
+    Compute Jaccard Similarity between two sparse vectors,
+    represented as dicts.
+    '''
+    # checking for set membership is fast
+    keys1 = set(vector1.keys())
+    keys2 = set(vector2.keys())
+    all_keys = keys1.union(keys2)
+    union = len(all_keys)
+    intersection = 0.
+    for key in all_keys:
+        if key in vector1 and key in vector2:
+            intersection += 1.
+    return intersection / union
+
+
+def _csr(matrix):
+    if hasattr(matrix, "tocsr"):
+        return matrix.tocsr()
+    return sparse.csr_matrix(matrix)
+
+
+def _levels(X):
+    """
+    Split a matrix of non-negative integers into binary matrices, one per
+    distinct value.
+
+    Returns a list of (step, level) such that X = sum(step * level) and
+    min(x, y) = sum(step * level_x * level_y) elementwise, which lets the
+    weighted Jaccard numerator be computed with matrix products. There is one
+    level, and one copy of X, per distinct value, which is cheap for counts
+    but not for real-valued weights such as tf-idf, so those are rejected.
+    """
+    if np.any(X.data < 0) or np.any(X.data != np.round(X.data)):
+        raise ValueError("Weighted Jaccard needs non-negative integer "
+                         "weights, such as term counts")
+    levels = []
+    previous = 0
+    for value in np.unique(X.data):
+        if value == 0:
+            continue
+        level = X.copy()
+        level.data = (X.data >= value).astype(np.float64)
+        level.eliminate_zeros()
+        levels.append((value - previous, level))
+        previous = value
+    return levels
+
+
+def iter_jaccard_blocks(matrix, weighted=False, block_size=1024):
+    """
+    Generator that yields (start, block) for consecutive blocks of rows of the
+    all-pairs Jaccard similarity matrix.
+
+    Parameters
+    ----------
+    matrix : CorpusMatrix or scipy.sparse matrix
+        Documents by terms. Only the nonzero pattern is used unless
+        `weighted` is True.
+    weighted : bool
+        Compute the weighted Jaccard similarity, sum(min(x, y)) / sum(max(x, y)),
+        for non-negative integer weights such as term counts. Raises
+        ValueError for other weights.
+    block_size : int
+        Number of rows per block. Each block is a dense block_size x N array.
+
+    Notes
+    -----
+    The similarity of two empty documents is defined as 0.
+    """
+    X = _csr(matrix)
+    n = X.shape[0]
+    if weighted:
+        X = X.astype(np.float64)
+        sizes = np.asarray(X.sum(axis=1)).ravel()
+        levels = [(step, level, level.T.tocsr())
+                  for step, level in _levels(X)]
+    else:
+        X = X.copy()
+        X.data = (X.data != 0).astype(np.float64)
+        X.eliminate_zeros()
+        sizes = np.asarray(X.sum(axis=1)).ravel()
+        levels = [(1., X, X.T.tocsr())]
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        intersection = np.zeros((stop - start, n))
+        for step, level, level_t in levels:
+            intersection += step * (level[start:stop] * level_t).toarray()
+        union = sizes[start:stop, None] + sizes[None, :] - intersection
+        with np.errstate(divide="ignore", invalid="ignore"):
+            block = np.where(union > 0, intersection / union, 0.)
+        yield start, block
+
+
+def jaccard_matrix(matrix, weighted=False, block_size=1024, out=None):
+    """
+    Compute the N x N Jaccard similarity matrix of the rows of `matrix`.
+
+    See `iter_jaccard_blocks` for the parameters. `out`, if given, is an
+    N x N array to fill, such as an `np.memmap`.
+    """
+    n = matrix.shape[0]
+    if out is None:
+        out = np.empty((n, n))
+    for start, block in iter_jaccard_blocks(matrix, weighted, block_size):
+        out[start:start + len(block)] = block
+    return out
+
+
+def top_k_cosine(queries, corpus=None, k=10, block_size=1024,
+                 exclude_self=False):
+    """
+    Find the `k` rows of `corpus` most similar to each row of `queries`.
+
+    Parameters
+    ----------
+    queries : CorpusMatrix or scipy.sparse matrix
+        L2-normalized rows, so that dot products are cosine similarities.
+    corpus : CorpusMatrix or scipy.sparse matrix, optional
+        L2-normalized rows to search, with the same columns as `queries`.
+        Defaults to `queries`.
+    k : int
+        Number of neighbours to return.
+    block_size : int
+        Number of query rows per block. Each block is a dense
+        block_size x n_corpus array.
+    exclude_self : bool
+        Do not return row i of `corpus` as a neighbour of query row i. Use
+        when `corpus` is `queries`.
+
+    Returns
+    -------
+    indices : ndarray
+        n_queries x k array of corpus row numbers, most similar first.
+    scores : ndarray
+        n_queries x k array of the cosine similarities.
+    """
+    Q = _csr(queries)
+    C = Q if corpus is None else _csr(corpus)
+    n_columns = max(Q.shape[1], C.shape[1])
+    Q = sparse.csr_matrix((Q.data, Q.indices, Q.indptr),
+                          shape=(Q.shape[0], n_columns))
+    C_t = sparse.csr_matrix((C.data, C.indices, C.indptr),
+                            shape=(C.shape[0], n_columns)).T.tocsr()
+    n_queries, n_corpus = Q.shape[0], C.shape[0]
+    k = min(k, n_corpus - 1 if exclude_self else n_corpus)
+
+    indices = np.empty((n_queries, k), dtype=np.int64)
+    scores = np.empty((n_queries, k))
+    for start in range(0, n_queries, block_size):
+        stop = min(start + block_size, n_queries)
+        block = (Q[start:stop] * C_t).toarray()
+        if exclude_self:
+            rows = np.arange(stop - start)
+            block[rows, rows + start] = -np.inf
+        if k < n_corpus:
+            best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        else:
+            best = np.tile(np.arange(n_corpus), (stop - start, 1))
+        best_scores = np.take_along_axis(block, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        indices[start:stop] = np.take_along_axis(best, order, axis=1)
+        scores[start:stop] = np.take_along_axis(best_scores, order, axis=1)
+    return indices, scores
@@ -0,0 +1,158 @@
+"""
+Per-elector store for incremental refreshes of the scraped corpus.
+
+wiki_scrape.py dumps every elector into one ElectorData05.json and has no
+idea what changed since the last run. `ElectorStore` keeps each elector in its
+own JSON shard and records the revision id it was built from, and `refresh`
+makes one cheap batched revision check, so that only pages edited since the
+last run are fetched and processed again.
+
+    >>> store = ElectorStore("./electors")
+    >>> stale, failed = refresh(electors, store, process=process)
+"""
+import hashlib
+import json
+import os
+
+from wiki_api import QUERY_LIMIT, fetch_electors_batched, page_title, query_pages
+from wiki_fetch import Fetcher
+
+
+class ElectorStore(object):
+    """
+    A directory of elector dicts, one JSON file each, plus an index of the
+    revision id each one was built from.
+
+    Electors are keyed by the page title in their url.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as fin:
+                self.index = json.load(fin)
+        else:
+            self.index = {}
+
+    def _path(self, title):
+        key = hashlib.sha1(title.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _write(self, path, obj):
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as fout:
+            json.dump(obj, fout)
+        os.rename(tmp, path)
+
+    def revid(self, title):
+        return self.index.get(title)
+
+    def load(self, title):
+        with open(self._path(title)) as fin:
+            return json.load(fin)
+
+    def save(self, title, elector):
+        """
+        Write an elector to its shard. Call `save_index` when done.
+        """
+        self._write(self._path(title), elector)
+        self.index[title] = elector.get("revid")
+
+    def save_index(self):
+        self._write(self.index_path, self.index)
+
+    def __contains__(self, title):
+        return title in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+def current_revids(titles, fetcher, batch_size=QUERY_LIMIT):
+    """
+    Look up the latest revision id of each title, `batch_size` titles per
+    request.
+
+    Returns a dict of title to revid, or None for missing pages.
+    """
+    batches = [titles[i:i + batch_size]
+               for i in range(0, len(titles), batch_size)]
+
+    def fetch(batch):
+        return query_pages(batch, fetcher.open, rvprop="ids")
+
+    revids = {}
+    for result in fetcher.map(fetch, batches):
+        if result.error is not None:
+            raise result.error
+        for title, page in result.value.items():
+            if page.get("revisions"):
+                revids[title] = page["revisions"][0]["revid"]
+            else:
+                revids[title] = None
+    return revids
+
+
+def refresh(electors, store, fetcher=None, process=None):
+    """
+    Bring `electors` up to date, fetching only the pages that changed.
+
+    Electors whose page revision matches the one in `store` are filled in
+    from the store. The rest are fetched with `fetch_electors_batched`,
+    passed to `process` and saved back to the store.
+
+    Parameters
+    ----------
+    electors : list of dict
+        Elector dicts with at least a "url".
+    store : ElectorStore
+    fetcher : wiki_fetch.Fetcher, optional
+    process : callable, optional
+        Called with each freshly fetched elector dict to update it in place,
+        for example
+
+            def process(elector):
+                text = clean_text(elector["text"], punc_pattern,
+                                  space_pattern).lower()
+                text = remove_stop_words(text, all_stopwords)
+                elector["text_vector"] = dict(combine(count(text)))
+
+    Returns
+    -------
+    stale : list of dict
+        The electors that were fetched again.
+    failed : list of wiki_fetch.Result
+        The electors that could not be fetched.
+    """
+    if fetcher is None:
+        fetcher = Fetcher()
+    titles = [page_title(elector["url"]) for elector in electors]
+    revids = current_revids(list(set(titles)), fetcher)
+
+    stale = []
+    for title, elector in zip(titles, electors):
+        if title in store and store.revid(title) == revids[title]:
+            elector.update(store.load(title))
+        else:
+            stale.append(elector)
+
+    failed = []
+    if stale:
+        failed = fetch_electors_batched(stale, fetcher)
+    failed_ids = set(id(result.item) for result in failed)
+    for elector in stale:
+        if id(elector) in failed_ids:
+            continue
+        if process is not None:
+            process(elector)
+        store.save(page_title(elector["url"]), elector)
+    store.save_index()
+    return stale, failed
@@ -0,0 +1,306 @@
+"""
+Corpus-level vocabulary and sparse matrix representation of the text vectors.
+
+Each elector's "text_vector" is a dict of n-gram strings to counts, so the
+same strings are repeated in every document and anything computed across the
+corpus loops over dicts in Python. Here the n-grams are given integer ids by a
+single `Vocabulary` and the corpus is stored as a compressed sparse row matrix
+with one row per document:
+
+    >>> matrix = CorpusMatrix.from_dicts(e["text_vector"] for e in electors)
+    >>> matrix.indptr, matrix.indices, matrix.data
+    >>> matrix.to_dict(0) == electors[0]["text_vector"]
+    True
+
+`TfidfWeighter` keeps the document frequencies of the vocabulary and turns
+counts into L2-normalized TF-IDF weights. Its statistics are updated as new
+documents arrive rather than recomputed over the whole corpus:
+
+    >>> tfidf = TfidfWeighter()
+    >>> tfidf.update(matrix)
+    >>> weights = tfidf.transform(matrix)
+"""
+import zlib
+from array import array
+from itertools import repeat
+
+import numpy as np
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+
+class Vocabulary(object):
+    """
+    Maps n-gram strings to integer ids, in the order they were first seen.
+    """
+    def __init__(self, ngrams=()):
+        self.ids = {}
+        self.ngrams = []
+        for ngram in ngrams:
+            self.add(ngram)
+
+    def add(self, ngram):
+        """
+        Returns the id of `ngram`, adding it if it is new.
+        """
+        ngram_id = self.ids.get(ngram)
+        if ngram_id is None:
+            ngram_id = self.ids[ngram] = len(self.ngrams)
+            self.ngrams.append(ngram)
+        return ngram_id
+
+    def add_all(self, ngrams):
+        """
+        Returns an array of the ids of distinct `ngrams`, adding the new ones.
+        """
+        # one lookup per n-gram, and an insert per new one
+        found = np.fromiter(map(self.ids.get, ngrams, repeat(-1)),
+                            dtype=np.int64, count=len(ngrams))
+        missing = np.flatnonzero(found < 0)
+        new = [ngrams[i] for i in missing.tolist()]
+        new_ids = range(len(self.ngrams), len(self.ngrams) + len(new))
+        found[missing] = new_ids
+        self.ids.update(zip(new, new_ids))
+        self.ngrams.extend(new)
+        return found.astype(np.int32)
+
+    def get(self, ngram, default=None):
+        return self.ids.get(ngram, default)
+
+    def __getitem__(self, ngram):
+        return self.ids[ngram]
+
+    def __contains__(self, ngram):
+        return ngram in self.ids
+
+    def __iter__(self):
+        return iter(self.ngrams)
+
+    def __len__(self):
+        return len(self.ngrams)
+
+
+class HashedVocabulary(object):
+    """
+    Stands in for a `Vocabulary` when the column ids are the crc32 of the
+    n-grams modulo `n_features`. No n-gram strings are kept, so the ids
+    cannot be turned back into n-grams.
+    """
+    def __init__(self, n_features=2**20):
+        self.n_features = n_features
+
+    def add(self, ngram):
+        """
+        Returns the column id of `ngram`.
+        """
+        return ((zlib.crc32(ngram.encode("utf-8")) & 0xffffffff) %
+                self.n_features)
+
+    def get(self, ngram, default=None):
+        return self.add(ngram)
+
+    __getitem__ = add
+
+    def __len__(self):
+        return self.n_features
+
+
+class CorpusMatrix(object):
+    """
+    Compressed sparse row matrix of documents by n-grams.
+
+    The columns of row `i` are `indices[indptr[i]:indptr[i+1]]`, in increasing
+    order, and their values are the same slice of `data`.
+
+    Parameters
+    ----------
+    indptr : ndarray
+        Row offsets into `indices` and `data`, of length n_docs + 1.
+    indices : ndarray
+        Column (n-gram) ids.
+    data : ndarray
+        Counts or weights.
+    vocabulary : Vocabulary or HashedVocabulary
+        The n-grams the column ids refer to.
+    """
+    def __init__(self, indptr, indices, data, vocabulary):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.vocabulary = vocabulary
+
+    @classmethod
+    def from_dicts(cls, text_vectors, vocabulary=None):
+        """
+        Build the matrix from an iterable of text_vector dicts.
+        """
+        builder = MatrixBuilder(vocabulary)
+        for text_vector in text_vectors:
+            builder.add(text_vector)
+        return builder.build()
+
+    @property
+    def shape(self):
+        # the vocabulary may be shared and keep growing after the matrix
+        # is built
+        return len(self.indptr) - 1, len(self.vocabulary)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def row(self, i):
+        """
+        Returns the (indices, data) of row `i`.
+        """
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:stop], self.data[start:stop]
+
+    def to_dict(self, i):
+        """
+        Convert row `i` back to a text_vector dict.
+        """
+        ngrams = self.vocabulary.ngrams
+        indices, data = self.row(i)
+        return dict((ngrams[j], value)
+                    for j, value in zip(indices.tolist(), data.tolist()))
+
+    def to_dicts(self):
+        return [self.to_dict(i) for i in range(len(self))]
+
+    def tocsr(self):
+        """
+        Returns the matrix as a `scipy.sparse.csr_matrix`.
+        """
+        if sparse is None:
+            raise ImportError("scipy is needed for tocsr")
+        return sparse.csr_matrix((self.data, self.indices, self.indptr),
+                                 shape=self.shape)
+
+
+class MatrixBuilder(object):
+    """
+    Builds a `CorpusMatrix` one document at a time.
+
+    Parameters
+    ----------
+    vocabulary : Vocabulary, optional
+        A vocabulary to share with other matrices. New n-grams are added to
+        it.
+    dtype : str
+        Array typecode for the values. "i" for counts, "d" for weights.
+    """
+    def __init__(self, vocabulary=None, dtype="i"):
+        if vocabulary is None:
+            vocabulary = Vocabulary()
+        self.vocabulary = vocabulary
+        self.indptr = array("l", [0])
+        self.indices = array("i")
+        self.data = array(dtype)
+
+    def add(self, text_vector):
+        """
+        Add a document given as a dict of n-gram to count.
+        """
+        add = self.vocabulary.add
+        row = sorted((add(ngram), value)
+                     for ngram, value in text_vector.items())
+        self.indices.extend(j for j, _ in row)
+        self.data.extend(value for _, value in row)
+        self.indptr.append(len(self.indices))
+
+    def add_row(self, indices, data):
+        """
+        Add a document given as sequences of column ids and values. The ids
+        must be in increasing order.
+        """
+        self.indices.extend(indices)
+        self.data.extend(data)
+        self.indptr.append(len(self.indices))
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def build(self):
+        return CorpusMatrix(np.array(self.indptr, dtype=np.int64),
+                            np.array(self.indices, dtype=np.int32),
+                            np.array(self.data),
+                            self.vocabulary)
+
+
+class TfidfWeighter(object):
+    """
+    TF-IDF weighting with incrementally updated document frequencies.
+
+    Parameters
+    ----------
+    smooth_idf : bool
+        Use idf = log((1 + n_docs) / (1 + df)) + 1, which is defined for terms
+        no document has been counted for yet. Otherwise
+        idf = log(n_docs / df) + 1.
+    sublinear_tf : bool
+        Use 1 + log(tf) instead of the raw counts.
+
+    Notes
+    -----
+    All of the matrices passed to a weighter must share one `Vocabulary`.
+    """
+    def __init__(self, smooth_idf=True, sublinear_tf=False):
+        self.smooth_idf = smooth_idf
+        self.sublinear_tf = sublinear_tf
+        self.n_docs = 0
+        self.df = np.zeros(0, dtype=np.int64)
+
+    def _resize(self, n_terms):
+        if n_terms > len(self.df):
+            df = np.zeros(n_terms, dtype=np.int64)
+            df[:len(self.df)] = self.df
+            self.df = df
+
+    def update(self, matrix):
+        """
+        Add the documents in `matrix` to the document frequencies.
+        """
+        n_terms = matrix.shape[1]
+        self._resize(n_terms)
+        # column ids are unique within a row, so this counts documents
+        self.df[:n_terms] += np.bincount(matrix.indices, minlength=n_terms)
+        self.n_docs += len(matrix)
+        return self
+
+    def idf(self, n_terms=None):
+        """
+        Returns the inverse document frequency of the first `n_terms` terms.
+        """
+        if n_terms is None:
+            n_terms = len(self.df)
+        self._resize(n_terms)
+        df = self.df[:n_terms].astype(np.float64)
+        if self.smooth_idf:
+            return np.log((1. + self.n_docs) / (1. + df)) + 1.
+        with np.errstate(divide="ignore"):
+            return np.log(float(self.n_docs) / df) + 1.
+
+    def transform(self, matrix, normalize=True):
+        """
+        Returns a new `CorpusMatrix` of TF-IDF weights for `matrix`, with
+        L2-normalized rows if `normalize` is True.
+        """
+        tf = matrix.data.astype(np.float64)
+        if self.sublinear_tf:
+            tf = 1. + np.log(tf)
+        data = tf * self.idf(matrix.shape[1])[matrix.indices]
+        if normalize:
+            n = len(matrix)
+            rows = np.repeat(np.arange(n), np.diff(matrix.indptr))
+            norms = np.sqrt(np.bincount(rows, weights=data ** 2, minlength=n))
+            norms[norms == 0] = 1.
+            data /= norms[rows]
+        return CorpusMatrix(matrix.indptr, matrix.indices, data,
+                            matrix.vocabulary)